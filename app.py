@@ -1,32 +1,114 @@
 import os
+import json
 import io
-from datetime import datetime, date, timedelta
+import re
+import csv
+import time
+import queue
+import atexit
+import zipfile
+import zlib
+import tempfile
+import importlib.util
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date, timedelta, timezone, MINYEAR, MAXYEAR
 from functools import wraps
+from collections import defaultdict
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context, session, make_response, g, has_request_context, abort
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user, login_url
 from werkzeug.security import generate_password_hash
-from sqlalchemy import func, or_, and_, extract
-from sqlalchemy.orm import joinedload
-import pandas as pd
-from docx import Document
-from docx.shared import Pt, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import inch
-
-from models import db, User, Tingkatan, Kelas, Murid, CategoryAlasan, KehadiranLewat, Denda, ActivityLog, SuratAmaran
+from sqlalchemy import func, or_, and_, extract, case, insert, select, update, text, table, column, event, literal_column
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, joinedload, contains_eager, selectinload
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from surat import BULAN_NAMES, render_surat, render_surat_merged, surat_filename
+from laporan import render_laporan_pdf, laporan_filename
+from artifacts import ArtifactStore
+from models import db, User, Tingkatan, Kelas, Murid, CategoryAlasan, KehadiranLewat, Denda, ActivityLog, SuratAmaran, RumusanHarian, KiraanLewatBulanan, CheckinIdempotency, DataVersion, ReportJob
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET") or os.environ.get("FLASK_SECRET_KEY") or "sistem-kehadiran-lewat-secret-key-2024"
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+# Production server size, read by "flask serve". WEB_WORKERS processes
+# (gunicorn only; waitress is single-process) each run WEB_THREADS threads.
+app.config["WEB_WORKERS"] = int(os.environ.get("WEB_WORKERS", 2))
+app.config["WEB_THREADS"] = int(os.environ.get("WEB_THREADS", 8))
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+if not (app.config["SQLALCHEMY_DATABASE_URI"] or "").startswith("sqlite"):
+    # One connection per request slot (see RequestSlots) plus the activity
+    # log writer and the report worker, so requests never wait on the pool;
+    # the overflow absorbs the live poller, CLI jobs and batch rendering.
+    # The server needs max_connections of at least
+    # WEB_WORKERS * (pool_size + max_overflow).
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", app.config["WEB_THREADS"] + 2)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 2)),
+        pool_timeout=30,
+    )
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(hours=8)
+app.config["ACADEMIC_YEAR_START_MONTH"] = int(os.environ.get("ACADEMIC_YEAR_START_MONTH", 1))
+# Weekly stats are also keyed on the data version, so this only bounds
+# how long an unchanged value is kept
+app.config["STATS_CACHE_TTL"] = int(os.environ.get("STATS_CACHE_TTL", 30))
+app.config["REFERENCE_CACHE_CHECK"] = float(os.environ.get("REFERENCE_CACHE_CHECK", 5))
+
+app.config["HISTORY_PAGE_SIZE"] = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+
+app.config["ACTIVITY_LOG_SYNC"] = os.environ.get("ACTIVITY_LOG_SYNC", "0") == "1"
+app.config["ACTIVITY_LOG_BATCH_SIZE"] = int(os.environ.get("ACTIVITY_LOG_BATCH_SIZE", 100))
+app.config["ACTIVITY_LOG_FLUSH_INTERVAL"] = float(os.environ.get("ACTIVITY_LOG_FLUSH_INTERVAL", 2.0))
+app.config["SURAT_WORKERS"] = int(os.environ.get("SURAT_WORKERS", os.cpu_count() or 1))
+
+app.config["SEARCH_CACHE_MAX_AGE"] = int(os.environ.get("SEARCH_CACHE_MAX_AGE", 30))
+
+# Each open /api/stream holds a server thread, so a process accepts at most
+# LIVE_MAX_STREAMS of them and "flask serve" adds that many threads on top
+# of WEB_THREADS. Screens beyond the cap poll /api/stats instead.
+app.config["LIVE_MAX_STREAMS"] = int(os.environ.get("LIVE_MAX_STREAMS", 50))
+# How often a process with open streams checks the shared data version
+app.config["LIVE_POLL_INTERVAL"] = float(os.environ.get("LIVE_POLL_INTERVAL", 2))
+
+# Rendered PDF reports and surat amaran for closed months, reused until
+# their records change. The report worker prunes files unused for
+# ARTIFACT_MAX_AGE_DAYS, then the least recently used beyond ARTIFACT_MAX_MB.
+app.config["ARTIFACT_DIR"] = os.environ.get("ARTIFACT_DIR") or os.path.join(app.instance_path, "artifacts")
+app.config["ARTIFACT_MAX_MB"] = float(os.environ.get("ARTIFACT_MAX_MB", 500))
+app.config["ARTIFACT_MAX_AGE_DAYS"] = float(os.environ.get("ARTIFACT_MAX_AGE_DAYS", 90))
+app.config["ARTIFACT_PRUNE_INTERVAL"] = float(os.environ.get("ARTIFACT_PRUNE_INTERVAL", 3600))
+# "flask serve" runs the report worker in each server process unless this is 0
+app.config["REPORT_WORKER"] = os.environ.get("REPORT_WORKER", "1") == "1"
+app.config["REPORT_WORKER_INTERVAL"] = float(os.environ.get("REPORT_WORKER_INTERVAL", 60))
+# A job running longer than this is assumed dead and is picked up again
+app.config["REPORT_JOB_TIMEOUT"] = int(os.environ.get("REPORT_JOB_TIMEOUT", 1800))
+
+# Requests slower than this, or running more statements, are logged
+app.config["SLOW_REQUEST_MS"] = float(os.environ.get("SLOW_REQUEST_MS", 500))
+app.config["SLOW_REQUEST_QUERIES"] = int(os.environ.get("SLOW_REQUEST_QUERIES", 50))
+# Lets a Prometheus scraper read /metrics without an admin session
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+
+app.config["IC_PATTERN"] = os.environ.get("IC_PATTERN", r"^\d{12}$")
+
+HISTORY_MAX_PAGE_SIZE = 500
+# Smaller batches render inline; pool start-up would cost more than it saves
+SURAT_POOL_MIN_BATCH = 8
+CSV_CHUNK_SIZE = 1000
+LAPORAN_CHUNK_SIZE = 2000
+IMPORT_CHUNK_SIZE = 1000
+# Rows per multi-row INSERT, well under SQLite's bind-variable limit
+DENDA_CHUNK_SIZE = 500
+CHECKIN_BATCH_MAX = 500
+IMPORT_BATCH_SIZE = 500
+CSV_FLUSH_BYTES = 16 * 1024
 
 db.init_app(app)
 
@@ -38,107 +120,2062 @@ login_manager.login_message_category = 'warning'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return get_users().get(int(user_id))
+
+def is_api_request():
+    return request.path.startswith('/api/')
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    # API clients get a status they can act on instead of the login page
+    if is_api_request():
+        return jsonify({'success': False, 'error': 'Sesi telah tamat, sila log masuk semula'}), 401
+    flash(login_manager.login_message, login_manager.login_message_category)
+    return redirect(login_url(login_manager.login_view, request.url))
 
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated or current_user.role != 'admin':
+            if is_api_request():
+                return jsonify({'success': False, 'error': 'Anda tidak mempunyai akses ke halaman ini.'}), 403
             flash('Anda tidak mempunyai akses ke halaman ini.', 'danger')
             return redirect(url_for('dashboard_overview'))
         return f(*args, **kwargs)
     return decorated_function
 
-def log_activity(action, description=None):
-    if current_user.is_authenticated:
-        log = ActivityLog(
-            user_id=current_user.id,
-            action=action,
-            description=description
+class ActivityLogWriter:
+    """Queue ActivityLog rows in-process and bulk-insert them from a background thread.
+
+    A batch is written once ACTIVITY_LOG_BATCH_SIZE entries are waiting or
+    ACTIVITY_LOG_FLUSH_INTERVAL seconds have passed. close() runs at exit
+    and writes whatever is still queued.
+    """
+
+    _STOP = object()
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def write(self, entry):
+        self._ensure_started()
+        self._queue.put(entry)
+
+    def _ensure_started(self):
+        # Started lazily, and again in a forked worker, which inherits the
+        # queue but not the thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch, stopping = self._take()
+            if batch:
+                self._flush(batch)
+            if stopping:
+                return
+
+    def _take(self):
+        batch = []
+        deadline = time.monotonic() + app.config['ACTIVITY_LOG_FLUSH_INTERVAL']
+        while len(batch) < app.config['ACTIVITY_LOG_BATCH_SIZE']:
+            try:
+                entry = self._queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                break
+            if entry is self._STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            with app.app_context():
+                db.session.execute(insert(ActivityLog), batch)
+                db.session.commit()
+            self.flushed += len(batch)
+        except Exception:
+            app.logger.exception('Gagal menulis %d log aktiviti', len(batch))
+            self.failed += len(batch)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.flushes += 1
+            self.flush_seconds += elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout=30)
+
+        batch = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not self._STOP:
+                batch.append(entry)
+        if batch:
+            self._flush(batch)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'avg_flush_ms': round(self.flush_seconds / self.flushes * 1000, 2) if self.flushes else 0.0,
+            'max_flush_ms': round(self.max_flush_seconds * 1000, 2)
+        }
+
+activity_log_writer = ActivityLogWriter()
+atexit.register(activity_log_writer.close)
+
+def log_activity(action, description=None, commit=True):
+    """Record an audit entry for the current user.
+
+    Entries normally go through activity_log_writer and are written after
+    the request. With ACTIVITY_LOG_SYNC the row is added to the current
+    session instead, and committed unless commit is False.
+    """
+    if not current_user.is_authenticated:
+        return
+
+    if not app.config['ACTIVITY_LOG_SYNC']:
+        activity_log_writer.write({
+            'user_id': current_user.id,
+            'action': action,
+            'description': description,
+            'created_at': datetime.utcnow()
+        })
+        return
+
+    log = ActivityLog(
+        user_id=current_user.id,
+        action=action,
+        description=description
+    )
+    db.session.add(log)
+    if commit:
+        db.session.commit()
+
+# Request instrumentation. Engine events time every statement run while a
+# request is active; after_request turns the totals into a Server-Timing
+# header, logs slow or query-heavy requests with their slowest statement,
+# and feeds the per-route histograms served at /metrics. Each worker
+# process keeps its own histograms.
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.slowest = (0.0, None)
+
+    def record(self, statement, seconds, rows):
+        self.queries += 1
+        self.db_seconds += seconds
+        if rows > 0:
+            self.rows += rows
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+def current_request_stats():
+    return g.get('request_stats') if has_request_context() else None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_request_stats() is not None:
+        context._request_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats()
+    started = getattr(context, '_request_started', None)
+    if stats is None or started is None:
+        return
+    # rowcount is -1 for SELECTs on drivers that stream rows (sqlite3), so
+    # rows fetched is only reported where the driver knows it (psycopg2)
+    stats.record(statement, time.perf_counter() - started, cursor.rowcount)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            yield f'{name}_bucket{{{labels},le="{le}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total:g}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+class RouteMetrics:
+    HISTOGRAMS = {
+        'request_duration_seconds': ('Time to produce the response, per route',
+                                     [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]),
+        'request_db_seconds': ('Time spent in SQL statements, per route',
+                               [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5]),
+        'request_queries': ('SQL statements per request, per route',
+                            [0, 1, 2, 5, 10, 20, 50, 100, 250, 1000]),
+        'request_rows': ('Rows returned by SQL per request, where the driver reports it',
+                         [0, 10, 100, 1000, 10000, 100000]),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, route, **values):
+        with self._lock:
+            histograms = self._routes.get(route)
+            if histograms is None:
+                histograms = self._routes[route] = {
+                    name: Histogram(buckets) for name, (_, buckets) in self.HISTOGRAMS.items()
+                }
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def render(self, prefix='kehadiran_'):
+        lines = []
+        with self._lock:
+            for name, (description, _) in self.HISTOGRAMS.items():
+                lines.append(f'# HELP {prefix}{name} {description}')
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                for route in sorted(self._routes):
+                    lines.extend(self._routes[route][name].samples(prefix + name, f'route="{route}"'))
+        return lines
+
+route_metrics = RouteMetrics()
+
+# Request slots. "flask serve" runs WEB_THREADS + LIVE_MAX_STREAMS threads
+# in one pool and any of them can pick up an ordinary request, but the
+# database pool is sized for WEB_THREADS. A request takes one of
+# WEB_THREADS slots before it runs and gives it back when its app context
+# ends, as the database session does, so requests queue for a slot rather
+# than for a connection. A live stream's context ends once its snapshot is
+# taken, so open screens hold no slot; a body that queries while it is sent
+# takes one again through stream_with_slot.
+
+class RequestSlots:
+    def __init__(self, limit, timeout):
+        self.limit = limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.active += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+    def stats(self):
+        return {'limit': self.limit, 'active': self.active, 'rejected': self.rejected}
+
+request_slots = RequestSlots(app.config['WEB_THREADS'], timeout=30)
+
+@app.before_request
+def take_request_slot():
+    if not request_slots.acquire():
+        return Response('Pelayan sibuk, sila cuba sebentar lagi.', status=503, headers={'Retry-After': '5'})
+    g.request_slot = True
+
+@app.teardown_appcontext
+def return_request_slot(exc):
+    if g.pop('request_slot', False):
+        request_slots.release()
+
+def stream_with_slot(generator):
+    """stream_with_context for a body that queries while it is sent.
+
+    The view's slot went back when it returned, so the body takes one
+    again for as long as it runs.
+    """
+    @stream_with_context
+    def generate():
+        g.request_slot = request_slots.acquire()
+        yield from generator
+    return generate()
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = RequestStats()
+
+@app.after_request
+def finish_request_stats(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+
+    elapsed = time.perf_counter() - stats.started
+    route = request.endpoint or 'unknown'
+    route_metrics.observe(route, request_duration_seconds=elapsed, request_db_seconds=stats.db_seconds,
+                          request_queries=stats.queries, request_rows=stats.rows)
+
+    response.headers.add('Server-Timing', f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries"')
+    response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.1f}')
+
+    if elapsed * 1000 >= app.config['SLOW_REQUEST_MS'] or stats.queries >= app.config['SLOW_REQUEST_QUERIES']:
+        slowest_seconds, slowest_statement = stats.slowest
+        app.logger.warning(
+            'Permintaan perlahan %s %s: %.0f ms, %d query (%.0f ms dalam DB); paling lambat %.0f ms: %s',
+            request.method, request.full_path, elapsed * 1000, stats.queries, stats.db_seconds * 1000,
+            slowest_seconds * 1000, ' '.join((slowest_statement or '-').split())[:300]
         )
-        db.session.add(log)
+    return response
+
+def normalise_ic(ic):
+    """Strip dashes, spaces and case so IC lookups can hit the unique index."""
+    return re.sub(r'[^0-9A-Za-z]', '', ic or '').upper()
+
+def dialect_insert(model):
+    """INSERT construct with ON CONFLICT support for the configured database."""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# Period helpers. Every tarikh filter goes through a half-open [start, end)
+# range so the indexes on kehadiran_lewat.tarikh can be used; extract() on the
+# column forces a full table scan.
+
+def day_range(day):
+    return day, day + timedelta(days=1)
+
+def week_range(day=None):
+    day = day or date.today()
+    start = day - timedelta(days=day.weekday())
+    return start, start + timedelta(days=7)
+
+def month_range(year, month):
+    start = date(year, month, 1)
+    if month == 12:
+        return start, date(year + 1, 1, 1)
+    return start, date(year, month + 1, 1)
+
+def is_valid_month(month, year):
+    """True when month_range(year, month) can be built, for query-string input."""
+    return month in range(1, 13) and year is not None and MINYEAR <= year < MAXYEAR
+
+def is_closed_day(day):
+    """True for days before the current month, whose reports are final."""
+    return day < date.today().replace(day=1)
+
+def is_open_period(end):
+    """True while a period ending at end (exclusive) can still gain check-ins."""
+    return end > date.today()
+
+def current_academic_year(day=None):
+    day = day or date.today()
+    if day.month >= app.config['ACADEMIC_YEAR_START_MONTH']:
+        return day.year
+    return day.year - 1
+
+def academic_year_range(year):
+    start_month = app.config['ACADEMIC_YEAR_START_MONTH']
+    return date(year, start_month, 1), date(year + 1, start_month, 1)
+
+def academic_year_label(year):
+    if app.config['ACADEMIC_YEAR_START_MONTH'] == 1:
+        return str(year)
+    return f"{year}/{year + 1}"
+
+def in_period(start, end, column=None):
+    if column is None:
+        column = KehadiranLewat.tarikh
+    return and_(column >= start, column < end)
+
+def get_period_range(filter_type, month=None, year=None, filter_date=None):
+    """Resolve a history/export filter into a (start, end) tarikh range.
+
+    Returns None for "Semua rekod" or an invalid date.
+    """
+    today = date.today()
+
+    if filter_type == 'weekly':
+        return week_range(today)
+    if filter_type == 'monthly':
+        if month and year:
+            return month_range(year, month)
+        return month_range(today.year, today.month)
+    if filter_type == 'academic':
+        return academic_year_range(year or current_academic_year(today))
+    if filter_type == 'date' and filter_date:
+        try:
+            specific_date = datetime.strptime(filter_date, '%Y-%m-%d').date()
+        except ValueError:
+            return None
+        if specific_date == date.max:
+            # day_range would overflow past the last representable date
+            return None
+        return day_range(specific_date)
+    return None
+
+# Daily rollup. rumusan_harian holds one count per (tarikh, kelas, kategori,
+# jantina) so the overview never aggregates the raw kehadiran_lewat table.
+# Counts sit under each student's current kelas and jantina, as the
+# overview counted them before the rollup: edits, moves and promotion move
+# the student's history with them. Run `flask rebuild-rumusan` to resync
+# after corrections made outside the app.
+#
+# Each key has exactly one row (uq_rumusan_harian_kunci), and bumps are
+# upserts against it, so gates checking in at the same moment add to the
+# same row instead of each inserting one.
+
+RUMUSAN_HARIAN_KUNCI = [
+    RumusanHarian.tarikh,
+    RumusanHarian.kelas_id,
+    func.coalesce(RumusanHarian.category_id, literal_column('0')),
+    RumusanHarian.jantina,
+]
+
+def bump_rumusan_harian(tarikh, kelas_id, category_id, jantina, jumlah=1):
+    """Add to the rollup row for one check-in inside the caller's transaction."""
+    stmt = dialect_insert(RumusanHarian).values(
+        tarikh=tarikh, kelas_id=kelas_id, category_id=category_id, jantina=jantina, jumlah=jumlah
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=RUMUSAN_HARIAN_KUNCI,
+        set_={'jumlah': RumusanHarian.jumlah + stmt.excluded.jumlah}
+    ))
+
+def shift_rumusan_harian(murid_ids, sign):
+    """Add (sign=1) or take out (sign=-1) these students' check-ins under their current kelas and jantina.
+
+    Call with -1 before changing a student's kelas or jantina and with 1
+    after, in the same transaction. Either way it is one grouped upsert.
+    """
+    source = select(
+        KehadiranLewat.tarikh,
+        Murid.kelas_id,
+        KehadiranLewat.category_id,
+        Murid.jantina,
+        sign * func.count(KehadiranLewat.id)
+    ).join(Murid, Murid.id == KehadiranLewat.murid_id).where(
+        # SQLite needs the WHERE to parse an upsert from a SELECT
+        KehadiranLewat.murid_id.in_(murid_ids)
+    ).group_by(
+        KehadiranLewat.tarikh, Murid.kelas_id, KehadiranLewat.category_id, Murid.jantina
+    )
+    stmt = dialect_insert(RumusanHarian).from_select(
+        ['tarikh', 'kelas_id', 'category_id', 'jantina', 'jumlah'], source
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=RUMUSAN_HARIAN_KUNCI,
+        set_={'jumlah': RumusanHarian.jumlah + stmt.excluded.jumlah}
+    ))
+
+def rebuild_rumusan_harian(commit=True):
+    db.session.query(RumusanHarian).delete(synchronize_session=False)
+
+    source = select(
+        KehadiranLewat.tarikh,
+        Murid.kelas_id,
+        KehadiranLewat.category_id,
+        Murid.jantina,
+        func.count(KehadiranLewat.id)
+    ).join(Murid, Murid.id == KehadiranLewat.murid_id).group_by(
+        KehadiranLewat.tarikh, Murid.kelas_id, KehadiranLewat.category_id, Murid.jantina
+    )
+    db.session.execute(insert(RumusanHarian).from_select(
+        ['tarikh', 'kelas_id', 'category_id', 'jantina', 'jumlah'], source
+    ))
+    bump_data_version()
+    if commit:
         db.session.commit()
 
-def get_category_by_reason(reason):
+def get_rumusan_totals(start, end):
+    total, lelaki, perempuan = db.session.query(
+        func.coalesce(func.sum(RumusanHarian.jumlah), 0),
+        func.coalesce(func.sum(case((RumusanHarian.jantina == 'Lelaki', RumusanHarian.jumlah), else_=0)), 0),
+        func.coalesce(func.sum(case((RumusanHarian.jantina == 'Perempuan', RumusanHarian.jumlah), else_=0)), 0)
+    ).filter(in_period(start, end, RumusanHarian.tarikh)).one()
+
+    return {'total': int(total), 'lelaki': int(lelaki), 'perempuan': int(perempuan)}
+
+class CachedValue:
+    """Process-wide cache for one computed value.
+
+    Concurrent misses wait on a single refresh instead of each hitting the
+    database. invalidate() drops the value; a refresh that started before an
+    invalidation is returned to its callers but not stored.
+    """
+
+    def __init__(self, loader, ttl):
+        self._loader = loader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None
+        self._generation = 0
+
+    def get(self, key=None):
+        entry = self._entry
+        if entry and entry[0] == key and entry[1] > time.monotonic():
+            return entry[2]
+
+        with self._lock:
+            entry = self._entry
+            if entry and entry[0] == key and entry[1] > time.monotonic():
+                return entry[2]
+
+            generation = self._generation
+            value = self._loader()
+            if generation == self._generation:
+                self._entry = (key, time.monotonic() + self._ttl(), value)
+            return value
+
+    def invalidate(self):
+        self._generation += 1
+        self._entry = None
+
+def load_weekly_stats():
+    return get_rumusan_totals(*week_range())
+
+weekly_stats_cache = CachedValue(load_weekly_stats, lambda: app.config['STATS_CACHE_TTL'])
+
+def get_weekly_stats(versi=None):
+    # Keyed on the data version, which is shared by every worker process,
+    # so a check-in committed elsewhere is never answered from a stale
+    # copy; the week start rolls the cache over on Monday
+    if versi is None and has_request_context():
+        versi = g.get('data_version')
+    if versi is None:
+        versi = get_data_version().versi
+    return weekly_stats_cache.get((week_range()[0], versi))
+
+# Conditional GET. DataVersion holds a single row whose counter is bumped
+# inside every write transaction. Report routes derive their ETag from it,
+# so a repeat visit costs one primary-key lookup and a 304 instead of the
+# aggregation queries. The row lives in the database so every worker
+# process sees the same version.
+#
+# HISTORY_VERSION_ID moves with it, except for writes that cannot change a
+# closed month's reports or letters: check-ins dated this month, printed
+# surat and denda. Stored reports for closed periods are keyed on it.
+
+DATA_VERSION_ID = 1
+REFERENCE_VERSION_ID = 2
+HISTORY_VERSION_ID = 3
+
+def bump_data_version(version_id=DATA_VERSION_ID, history=True):
+    """Mark data as changed, inside the caller's transaction."""
+    ids = [version_id]
+    if version_id == DATA_VERSION_ID and history:
+        ids.append(HISTORY_VERSION_ID)
+    db.session.execute(update(DataVersion).where(DataVersion.id.in_(ids)).values(
+        versi=DataVersion.versi + 1, updated_at=datetime.utcnow()
+    ))
+
+def get_data_version(version_id=DATA_VERSION_ID):
+    return db.session.execute(select(DataVersion.versi, DataVersion.updated_at).where(
+        DataVersion.id == version_id
+    )).one()
+
+def conditional_get(view):
+    """Answer 304 before running the view when the client's copy is current.
+
+    The ETag covers the data version, the full request path, the user (the
+    layout shows their name and menu) and today's date, since views default
+    to the current week or month.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        # A pending flash message must be rendered, not swallowed by a 304
+        if session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        versi, updated_at = get_data_version()
+        g.data_version = versi
+        today = date.today()
+        user_id = current_user.get_id() if current_user.is_authenticated else '-'
+        etag = f'{versi}-{zlib.crc32(f"{request.full_path}|{user_id}|{today}".encode()):08x}'
+
+        # Data that has not changed since midnight still renders differently
+        # once the day rolls over
+        midnight = datetime.combine(today, datetime.min.time()).astimezone(timezone.utc)
+        last_modified = max(updated_at.replace(tzinfo=timezone.utc), midnight).replace(microsecond=0)
+
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        else:
+            not_modified = bool(request.if_modified_since) and request.if_modified_since >= last_modified
+
+        if not_modified:
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
+# Reference data. Tingkatan, Kelas, CategoryAlasan and User change a few
+# times a year but are read on most requests. ReferenceCache keeps them in
+# the process as detached objects, loaded in their own session so a commit
+# in the request never expires them. Writers bump the REFERENCE_VERSION_ID
+# row with their change and call reference_cache.invalidate() after
+# committing; other workers notice the new version within
+# REFERENCE_CACHE_CHECK seconds.
+
+class ReferenceCache:
+    def __init__(self, check_interval):
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._values = {}
+        self._version = None
+        self._checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def get(self, name, loader):
+        self._check_version()
+        values = self._values
+        if name in values:
+            self.hits += 1
+            return values[name]
+
+        with self._lock:
+            if name in self._values:
+                self.hits += 1
+                return self._values[name]
+
+            self.misses += 1
+            version = self._version
+            with Session(db.engine) as session:
+                value = loader(session)
+            if version == self._version:
+                self._values[name] = value
+            return value
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self._check_interval():
+            return
+
+        versi = get_data_version(REFERENCE_VERSION_ID).versi
+        with self._lock:
+            if versi != self._version:
+                if self._version is not None:
+                    self.reloads += 1
+                self._values = {}
+                self._version = versi
+            self._checked_at = now
+
+    def invalidate(self):
+        with self._lock:
+            self._values = {}
+            self._version = None
+            self._checked_at = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'reloads': self.reloads,
+            'version': self._version,
+            'entries': sorted(self._values)
+        }
+
+reference_cache = ReferenceCache(lambda: app.config['REFERENCE_CACHE_CHECK'])
+
+def get_tingkatan_list():
+    return reference_cache.get('tingkatan', lambda session: session.query(Tingkatan).options(
+        selectinload(Tingkatan.kelas)
+    ).order_by(Tingkatan.id).all())
+
+def get_kelas_list():
+    return reference_cache.get('kelas', lambda session: session.query(Kelas).options(
+        joinedload(Kelas.tingkatan)
+    ).order_by(Kelas.id).all())
+
+def get_categories():
+    return reference_cache.get('categories', lambda session: session.query(CategoryAlasan).order_by(
+        CategoryAlasan.id
+    ).all())
+
+def get_users():
+    return reference_cache.get('users', lambda session: {
+        user.id: user for user in session.query(User).all()
+    })
+
+# Live updates. Screens hold a Server-Sent Events connection at
+# /api/stream instead of polling /api/stats. While a process has screens
+# connected, one LiveBroadcaster thread reads the shared data version every
+# LIVE_POLL_INTERVAL seconds; when it moves, the thread loads the stats and
+# recent check-ins once and hands the same payload to every screen. A
+# check-in committed by any worker process is therefore seen by all of
+# them, at the cost of one primary-key lookup per interval per process.
+# A check-in committed in this process wakes the thread straight away.
+
+LIVE_QUEUE_SIZE = 20
+LIVE_HEARTBEAT = 15
+LIVE_RECENT_LIMIT = 10
+
+class LiveBroadcaster:
+    def __init__(self, max_subscribers, poll_interval, background=True):
+        self._max_subscribers = max_subscribers
+        self._poll_interval = poll_interval
+        self._background = background
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._version = None
+        self.rejected = 0
+
+    def subscribe(self, private=False):
+        """Register a screen; returns None when this process has no stream slot left."""
+        with self._lock:
+            if len(self._subscribers) >= self._max_subscribers():
+                self.rejected += 1
+                return None
+            subscriber = queue.Queue(maxsize=LIVE_QUEUE_SIZE)
+            self._subscribers[subscriber] = private
+            if self._background and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-broadcaster', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def has_subscribers(self, private=False):
+        with self._lock:
+            if private:
+                return any(self._subscribers.values())
+            return bool(self._subscribers)
+
+    def wake(self):
+        """Check the data version now instead of at the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._poll_interval())
+            self._wake.clear()
+            with self._lock:
+                # The last screen left; the next subscribe starts a new thread
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            try:
+                with app.app_context():
+                    self.poll()
+            except Exception:
+                app.logger.exception('Kemas kini langsung gagal')
+
+    def poll(self):
+        """Publish fresh stats if the data version moved since the last poll; returns whether it did."""
+        versi = get_data_version().versi
+        if versi == self._version:
+            return False
+        self._version = versi
+        self.publish('stats', get_weekly_stats(versi))
+        if self.has_subscribers(private=True):
+            recent = [serialize_recent_checkin(r) for r in get_recent_checkins()]
+            self.publish('recent', recent, private=True)
+        return True
+
+    def publish(self, event, data, private=False):
+        """Queue an event for every subscriber; private events skip anonymous screens."""
+        message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+        with self._lock:
+            targets = [q for q, p in self._subscribers.items() if p or not private]
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A screen that stopped reading is dropped; its browser
+                # reconnects and starts again from a fresh snapshot
+                self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), 'limit': self._max_subscribers(),
+                    'rejected': self.rejected}
+
+live_broadcaster = LiveBroadcaster(lambda: app.config['LIVE_MAX_STREAMS'],
+                                   lambda: app.config['LIVE_POLL_INTERVAL'])
+
+def serialize_recent_checkin(record):
+    return {
+        'id': record.id,
+        'nama_penuh': record.murid.nama_penuh,
+        'nama_kelas': record.murid.kelas.nama_kelas if record.murid.kelas else '',
+        'kategori': record.category.nama if record.category else None,
+        'tarikh': record.tarikh.strftime('%d/%m'),
+        'masa_sampai': record.masa_sampai.strftime('%H:%M')
+    }
+
+def get_recent_checkins(limit=LIVE_RECENT_LIMIT):
+    return KehadiranLewat.query.options(
+        joinedload(KehadiranLewat.murid).joinedload(Murid.kelas),
+        joinedload(KehadiranLewat.category)
+    ).order_by(KehadiranLewat.created_at.desc(), KehadiranLewat.id.desc()).limit(limit).all()
+
+def publish_checkin_update():
+    """Push a committed check-in to this process's screens without waiting for the next poll."""
+    live_broadcaster.wake()
+
+def live_stream(subscriber, initial):
+    try:
+        for message in initial:
+            yield message
+        while True:
+            try:
+                yield subscriber.get(timeout=LIVE_HEARTBEAT)
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle stream
+                yield ': ping\n\n'
+    finally:
+        live_broadcaster.unsubscribe(subscriber)
+
+# Reason classifier. Keywords come from CategoryAlasan.keywords and are
+# compiled into one regex with a named group per category. Keywords match
+# from the start of a word, so suffixed forms like "hujannya" still count.
+# When several categories match, the one created first wins, as with the
+# old hardcoded cuaca > keluarga > transport order. The compiled classifier
+# lives in reference_cache, so a keyword edit reaches every worker through
+# the reference version.
+
+DEFAULT_CATEGORY = 'Lain-lain'
+
+def load_category_classifier(session=None):
+    categories = (session or db.session).query(CategoryAlasan).order_by(CategoryAlasan.id).all()
+
+    default_id = None
+    groups = {}
+    parts = []
+    for category in categories:
+        if category.nama == DEFAULT_CATEGORY:
+            default_id = category.id
+        keywords = {k.strip().lower() for k in (category.keywords or '').split(',') if k.strip()}
+        if not keywords:
+            continue
+        group = f'c{category.id}'
+        groups[group] = category.id
+        alternation = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+        parts.append(f'(?P<{group}>\\b(?:{alternation}))')
+
+    pattern = re.compile('|'.join(parts)) if parts else None
+    return pattern, groups, default_id
+
+def get_category_classifier():
+    return reference_cache.get('classifier', load_category_classifier)
+
+def classify_alasan(reason, classifier=None):
+    """Return the CategoryAlasan id for a lateness reason, or None if it is blank."""
     if not reason:
         return None
 
-    reason_lower = reason.lower()
+    pattern, groups, default_id = classifier or get_category_classifier()
+    if pattern is None:
+        return default_id
+
+    matched = {match.lastgroup for match in pattern.finditer(reason.lower())}
+    if not matched:
+        return default_id
+    return min(groups[group] for group in matched)
+
+def reclassify_kehadiran(batch_size=1000):
+    """Re-run the classifier over every stored alasan; returns rows changed."""
+    classifier = load_category_classifier()
+    changed = 0
+    last_id = 0
+
+    while True:
+        rows = db.session.query(
+            KehadiranLewat.id, KehadiranLewat.alasan, KehadiranLewat.category_id
+        ).filter(KehadiranLewat.id > last_id).order_by(KehadiranLewat.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            category_id = classify_alasan(row.alasan, classifier)
+            if category_id != row.category_id:
+                updates.append({'id': row.id, 'category_id': category_id})
+
+        if updates:
+            db.session.execute(update(KehadiranLewat), updates)
+            bump_data_version()
+            db.session.commit()
+            changed += len(updates)
 
-    cuaca_keywords = ['hujan', 'panas', 'ribut', 'banjir', 'kilat', 'petir', 'sejuk', 'lebat', 'cuaca']
-    keluarga_keywords = ['sakit', 'hospital', 'kecemasan', 'emergency', 'ibu', 'bapa', 'adik', 'kakak', 
-                         'nenek', 'datuk', 'hantar', 'penghantar', 'keluarga', 'rumah']
-    transport_keywords = ['jalan', 'sesak', 'jam', 'traffic', 'kereta', 'motor', 'motosikal', 'bas', 
-                          'rosak', 'pancit', 'tayar', 'minyak', 'kemalangan', 'accident', 'kenderaan']
+    if changed:
+        rebuild_rumusan_harian()
+    return changed
 
-    category = CategoryAlasan.query.filter_by(nama='Lain-lain').first()
+# Per-student monthly counter. The check-in upsert bumps it and returns the
+# new value in one statement, so "lewat kali ke-N" needs no COUNT query.
 
-    if any(k in reason_lower for k in cuaca_keywords):
-        category = CategoryAlasan.query.filter_by(nama='Iklim/Cuaca').first()
-    elif any(k in reason_lower for k in keluarga_keywords):
-        category = CategoryAlasan.query.filter_by(nama='Masalah Keluarga').first()
-    elif any(k in reason_lower for k in transport_keywords):
-        category = CategoryAlasan.query.filter_by(nama='Masalah Transport').first()
+def bump_kiraan_bulanan(murid_id, tahun, bulan, jumlah=1):
+    stmt = dialect_insert(KiraanLewatBulanan).values(
+        murid_id=murid_id, tahun=tahun, bulan=bulan, jumlah=jumlah
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['murid_id', 'tahun', 'bulan'],
+        set_={'jumlah': KiraanLewatBulanan.jumlah + stmt.excluded.jumlah}
+    ).returning(KiraanLewatBulanan.jumlah)
+    return db.session.execute(stmt).scalar_one()
+
+def rebuild_kiraan_bulanan():
+    db.session.query(KiraanLewatBulanan).delete(synchronize_session=False)
+
+    tahun = extract('year', KehadiranLewat.tarikh)
+    bulan = extract('month', KehadiranLewat.tarikh)
+    source = select(
+        KehadiranLewat.murid_id, tahun, bulan, func.count(KehadiranLewat.id)
+    ).group_by(KehadiranLewat.murid_id, tahun, bulan)
+    db.session.execute(insert(KiraanLewatBulanan).from_select(
+        ['murid_id', 'tahun', 'bulan', 'jumlah'], source
+    ))
+    bump_data_version()
+    db.session.commit()
 
-    return category
+def record_checkin(murid, masa, minit_lewat, alasan, nota):
+    """Add one late arrival and update the rollups without committing.
+
+    murid only needs id, kelas_id and jantina. Returns the student's late
+    count for the month including this one.
+    """
+    category_id = classify_alasan(alasan)
+
+    db.session.add(KehadiranLewat(
+        murid_id=murid.id,
+        tarikh=masa.date(),
+        masa_sampai=masa.time(),
+        minit_lewat=minit_lewat,
+        alasan=alasan,
+        category_id=category_id,
+        nota=nota,
+        checked_by=current_user.id
+    ))
+    bump_rumusan_harian(masa.date(), murid.kelas_id, category_id, murid.jantina)
+    bump_data_version(history=is_closed_day(masa.date()))
+    return bump_kiraan_bulanan(murid.id, masa.year, masa.month)
+
+def parse_checkin_time(value):
+    """Parse an ISO 8601 timestamp into server-local naive time; None means now."""
+    if not value:
+        return datetime.now()
+    masa = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if masa.tzinfo is not None:
+        masa = masa.astimezone().replace(tzinfo=None)
+    return masa
+
+def record_checkin_batch(items):
+    """Record buffered gate check-ins in one transaction.
+
+    Each item has kunci (the client's idempotency key), murid_id or ic,
+    and optionally masa, alasan, nota and minit_lewat. A kunci seen before
+    returns its original result instead of inserting again. Returns one
+    result dict per item, in order, without committing.
+    """
+    results = [{'kunci': item.get('kunci') if isinstance(item, dict) else None} for item in items]
+    pending = []
+    seen_keys = set()
+
+    for result, item in zip(results, items):
+        if not isinstance(item, dict):
+            result.update(status='error', error='Item mesti objek JSON')
+            continue
+        kunci = item.get('kunci')
+        if not isinstance(kunci, str) or not kunci.strip() or len(kunci) > 100:
+            result.update(status='error', error='kunci diperlukan (maksimum 100 aksara)')
+            continue
+        if kunci in seen_keys:
+            result.update(status='error', error='kunci berulang dalam kelompok')
+            continue
+        seen_keys.add(kunci)
+        try:
+            masa = parse_checkin_time(item.get('masa'))
+            minit_lewat = int(item.get('minit_lewat') or 0)
+        except (TypeError, ValueError):
+            result.update(status='error', error='masa atau minit_lewat tidak sah')
+            continue
+        if not item.get('murid_id') and not item.get('ic'):
+            result.update(status='error', error='murid_id atau ic diperlukan')
+            continue
+        pending.append((result, item, masa, minit_lewat))
+
+    previous = {row.kunci: row for row in CheckinIdempotency.query.filter(
+        CheckinIdempotency.kunci.in_([item['kunci'] for _, item, _, _ in pending])
+    )} if pending else {}
+
+    murid_ids = {int(item['murid_id']) for _, item, _, _ in pending
+                 if item.get('murid_id') and str(item['murid_id']).isdigit()}
+    ics = {normalise_ic(item['ic']) for _, item, _, _ in pending if not item.get('murid_id')}
+    columns = (Murid.id, Murid.nama_penuh, Murid.ic, Murid.kelas_id, Murid.jantina)
+    by_id, by_ic = {}, {}
+    if murid_ids or ics:
+        for murid in db.session.query(*columns).filter(
+            Murid.is_deleted == False,
+            or_(Murid.id.in_(murid_ids), Murid.ic.in_(ics))
+        ):
+            by_id[murid.id] = murid
+            by_ic[murid.ic] = murid
+
+    created = []
+    for result, item, masa, minit_lewat in pending:
+        earlier = previous.get(item['kunci'])
+        if earlier:
+            result.update(status='duplicate', kehadiran_id=earlier.kehadiran_id,
+                          murid_id=earlier.murid_id, kiraan_bulan=earlier.kiraan_bulan)
+            continue
+
+        if item.get('murid_id'):
+            murid = by_id.get(int(item['murid_id'])) if str(item['murid_id']).isdigit() else None
+        else:
+            murid = by_ic.get(normalise_ic(item['ic']))
+        if murid is None:
+            result.update(status='error', error='Murid tidak dijumpai')
+            continue
 
-def get_weekly_stats():
-    today = date.today()
-    start_of_week = today - timedelta(days=today.weekday())
+        alasan = (item.get('alasan') or '').strip()
+        kehadiran = KehadiranLewat(
+            murid_id=murid.id,
+            tarikh=masa.date(),
+            masa_sampai=masa.time(),
+            minit_lewat=minit_lewat,
+            alasan=alasan,
+            category_id=classify_alasan(alasan),
+            nota=(item.get('nota') or '').strip(),
+            checked_by=current_user.id
+        )
+        db.session.add(kehadiran)
+        created.append((result, item, murid, kehadiran))
+
+    if not created:
+        return results
+
+    db.session.flush()
+
+    # One rollup and one counter statement per distinct key, not per item
+    rumusan = {}
+    kiraan = {}
+    for _, _, murid, kehadiran in created:
+        key = (kehadiran.tarikh, murid.kelas_id, kehadiran.category_id, murid.jantina)
+        rumusan[key] = rumusan.get(key, 0) + 1
+        key = (murid.id, kehadiran.tarikh.year, kehadiran.tarikh.month)
+        kiraan.setdefault(key, []).append(kehadiran)
+
+    for (tarikh, kelas_id, category_id, jantina), jumlah in rumusan.items():
+        bump_rumusan_harian(tarikh, kelas_id, category_id, jantina, jumlah)
+
+    counts = {}
+    for (murid_id, tahun, bulan), records in kiraan.items():
+        total = bump_kiraan_bulanan(murid_id, tahun, bulan, len(records))
+        records.sort(key=lambda k: (k.tarikh, k.masa_sampai))
+        for position, kehadiran in enumerate(records):
+            counts[kehadiran] = total - len(records) + position + 1
+
+    keys = []
+    for result, item, murid, kehadiran in created:
+        result.update(status='created', kehadiran_id=kehadiran.id, murid_id=murid.id,
+                      nama_penuh=murid.nama_penuh, kiraan_bulan=counts[kehadiran])
+        keys.append({'kunci': item['kunci'], 'kehadiran_id': kehadiran.id,
+                     'murid_id': murid.id, 'kiraan_bulan': counts[kehadiran]})
+    db.session.execute(insert(CheckinIdempotency), keys)
+    bump_data_version(history=any(is_closed_day(kehadiran.tarikh) for _, _, _, kehadiran in created))
+
+    return results
+
+def get_or_create_murid(nama_penuh, ic, jantina, kelas_id):
+    """Find a student by IC or create them, in one upsert on the unique index."""
+    stmt = dialect_insert(Murid).values(
+        nama_penuh=nama_penuh,
+        ic=normalise_ic(ic),
+        jantina=jantina,
+        kelas_id=kelas_id
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['ic'],
+        set_={'ic': stmt.excluded.ic}
+    ).returning(Murid.id, Murid.nama_penuh, Murid.kelas_id, Murid.jantina)
+    return db.session.execute(stmt).one()
 
-    total = KehadiranLewat.query.filter(
-        KehadiranLewat.tarikh >= start_of_week,
-        KehadiranLewat.tarikh <= today
-    ).count()
+def get_murid_with_warnings(month=None, year=None):
+    if month is None:
+        month = date.today().month
+    if year is None:
+        year = date.today().year
+    start, end = month_range(year, month)
 
-    lelaki = db.session.query(KehadiranLewat).join(Murid).filter(
-        KehadiranLewat.tarikh >= start_of_week,
-        KehadiranLewat.tarikh <= today,
-        Murid.jantina == 'Lelaki'
-    ).count()
+    # Count each student's records in the month with a window function so
+    # the flagged students and all their records come back in one query.
+    windowed = db.session.query(
+        KehadiranLewat.id.label('kehadiran_id'),
+        func.count(KehadiranLewat.id).over(partition_by=KehadiranLewat.murid_id).label('count')
+    ).filter(
+        in_period(start, end)
+    ).subquery()
 
-    perempuan = db.session.query(KehadiranLewat).join(Murid).filter(
-        KehadiranLewat.tarikh >= start_of_week,
-        KehadiranLewat.tarikh <= today,
-        Murid.jantina == 'Perempuan'
-    ).count()
+    rows = db.session.query(KehadiranLewat, windowed.c.count).join(
+        windowed, KehadiranLewat.id == windowed.c.kehadiran_id
+    ).filter(
+        windowed.c.count >= 3
+    ).options(
+        joinedload(KehadiranLewat.murid).joinedload(Murid.kelas)
+    ).order_by(KehadiranLewat.murid_id, KehadiranLewat.tarikh).all()
 
-    return {'total': total, 'lelaki': lelaki, 'perempuan': perempuan}
+    result = []
+    for kehadiran, count in rows:
+        if not result or result[-1]['murid'].id != kehadiran.murid_id:
+            result.append({
+                'murid': kehadiran.murid,
+                'count': count,
+                'kehadiran': []
+            })
+        result[-1]['kehadiran'].append(kehadiran)
 
-def get_murid_with_warnings(month=None, year=None):
+    return result
+
+def get_kelas_counts(kelas_ids=None):
+    """Active students and this month's late arrivals per kelas, in one query.
+
+    Returns a defaultdict keyed by kelas_id, so kelas with no students
+    read as zero.
+    """
+    today = date.today()
+    query = db.session.query(
+        Murid.kelas_id,
+        func.count(Murid.id),
+        func.coalesce(func.sum(KiraanLewatBulanan.jumlah), 0)
+    ).outerjoin(KiraanLewatBulanan, and_(
+        KiraanLewatBulanan.murid_id == Murid.id,
+        KiraanLewatBulanan.tahun == today.year,
+        KiraanLewatBulanan.bulan == today.month
+    )).filter(Murid.is_deleted == False).group_by(Murid.kelas_id)
+    if kelas_ids is not None:
+        query = query.filter(Murid.kelas_id.in_(kelas_ids))
+
+    counts = defaultdict(lambda: {'murid': 0, 'lewat': 0})
+    for kelas_id, murid, lewat in query:
+        counts[kelas_id] = {'murid': murid, 'lewat': int(lewat)}
+    return counts
+
+def sum_by_tingkatan(tingkatan_list, kelas_counts):
+    totals = {}
+    for tingkatan in tingkatan_list:
+        totals[tingkatan.id] = {
+            'murid': sum(kelas_counts[k.id]['murid'] for k in tingkatan.kelas),
+            'lewat': sum(kelas_counts[k.id]['lewat'] for k in tingkatan.kelas)
+        }
+    return totals
+
+# Bulk student changes. Each runs as set-based UPDATEs in one transaction
+# with one ActivityLog entry; with dry_run they only report what would
+# change. Students are soft-deleted, as delete_murid does.
+
+def count_active_murid(condition):
+    return db.session.query(func.count(Murid.id)).filter(condition, Murid.is_deleted == False).scalar()
+
+def bulk_soft_delete_murid(ids):
+    return db.session.execute(update(Murid).where(
+        Murid.id.in_(ids), Murid.is_deleted == False
+    ).values(is_deleted=True).execution_options(synchronize_session=False)).rowcount
+
+def bulk_move_murid(ids, kelas_id):
+    shift_rumusan_harian(ids, -1)
+    moved = db.session.execute(update(Murid).where(
+        Murid.id.in_(ids), Murid.is_deleted == False, Murid.kelas_id != kelas_id
+    ).values(kelas_id=kelas_id).execution_options(synchronize_session=False)).rowcount
+    shift_rumusan_harian(ids, 1)
+    return moved
+
+def kelas_suffix(nama_kelas):
+    """'1 Amanah' -> 'amanah': the part of a kelas name that stays when it moves up."""
+    return re.sub(r'^\s*\d+\s*', '', nama_kelas).strip().lower()
+
+def plan_promotion(tingkatan_ids):
+    """Work out where each kelas of the given Tingkatan moves.
+
+    A kelas moves to the kelas with the same name one Tingkatan up ('1
+    Amanah' to '2 Amanah'); kelas of the last Tingkatan graduate. Returns
+    (moves, graduating, unmatched): source to target kelas ids, kelas ids
+    that graduate, and kelas with no namesake above.
+    """
+    levels = sorted(get_tingkatan_list(), key=lambda t: t.id)
+    moves, graduating, unmatched = {}, [], []
+    for index, tingkatan in enumerate(levels):
+        if tingkatan.id not in tingkatan_ids:
+            continue
+        if index == len(levels) - 1:
+            graduating.extend(k.id for k in tingkatan.kelas)
+            continue
+        targets = {kelas_suffix(k.nama_kelas): k.id for k in levels[index + 1].kelas}
+        for kelas in tingkatan.kelas:
+            target = targets.get(kelas_suffix(kelas.nama_kelas))
+            if target:
+                moves[kelas.id] = target
+            else:
+                unmatched.append(kelas)
+    return moves, graduating, unmatched
+
+def promote_murid(moves, graduating):
+    # Graduate first so students moving into the last Tingkatan stay
+    graduated = 0
+    if graduating:
+        graduated = db.session.execute(update(Murid).where(
+            Murid.kelas_id.in_(graduating), Murid.is_deleted == False
+        ).values(is_deleted=True).execution_options(synchronize_session=False)).rowcount
+
+    promoted = 0
+    if moves:
+        promoted = db.session.execute(update(Murid).where(
+            Murid.kelas_id.in_(list(moves)), Murid.is_deleted == False
+        ).values(kelas_id=case(moves, value=Murid.kelas_id)).execution_options(synchronize_session=False)).rowcount
+        # Most of the school moves, so rebuilding the rollup in one
+        # statement beats shifting it student by student
+        rebuild_rumusan_harian(commit=False)
+    return promoted, graduated
+
+def count_murid_with_warnings(month=None, year=None):
     if month is None:
         month = date.today().month
     if year is None:
         year = date.today().year
 
-    subquery = db.session.query(
-        KehadiranLewat.murid_id,
-        func.count(KehadiranLewat.id).label('count')
+    return KiraanLewatBulanan.query.filter(
+        KiraanLewatBulanan.tahun == year,
+        KiraanLewatBulanan.bulan == month,
+        KiraanLewatBulanan.jumlah >= 3
+    ).count()
+
+def get_warning_murid_ids(month, year):
+    """Ids of students late 3 or more times in the month, from the monthly rollup."""
+    return [murid_id for (murid_id,) in db.session.query(KiraanLewatBulanan.murid_id).filter(
+        KiraanLewatBulanan.tahun == year,
+        KiraanLewatBulanan.bulan == month,
+        KiraanLewatBulanan.jumlah >= 3
+    )]
+
+# History filters shared by dashboard_history, /api/history and export_csv.
+# Queries passed to apply_history_filters must already join Murid and Kelas.
+
+def get_history_filters(default_filter='weekly'):
+    filters = {
+        'filter_type': request.args.get('filter', default_filter),
+        'date': request.args.get('date'),
+        'month': request.args.get('month', type=int),
+        'year': request.args.get('year', type=int),
+        'kelas': request.args.get('kelas', '').strip(),
+        'jantina': request.args.get('jantina', '').strip(),
+        'nama': request.args.get('nama', '').strip()
+    }
+    # An out-of-range month or year falls back to the current period
+    if filters['month'] not in range(1, 13):
+        filters['month'] = None
+    if not is_valid_month(filters['month'] or 1, filters['year']):
+        filters['year'] = None
+    return filters
+
+def apply_history_filters(query, filters, period):
+    if period:
+        query = query.filter(in_period(*period))
+
+    if filters['kelas']:
+        query = query.filter(Kelas.nama_kelas == filters['kelas'])
+
+    if filters['jantina']:
+        query = query.filter(Murid.jantina == filters['jantina'])
+
+    if filters['nama']:
+        query = query.filter(func.lower(Murid.nama_penuh).contains(filters['nama'].lower()))
+
+    return query
+
+def encode_history_cursor(record):
+    return f"{datetime.combine(record.tarikh, record.masa_sampai).isoformat()}|{record.id}"
+
+def decode_history_cursor(cursor):
+    try:
+        stamp, record_id = cursor.split('|')
+        stamp = datetime.fromisoformat(stamp)
+        return stamp.date(), stamp.time(), int(record_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_history_page(filters, period, after=None, page_size=None):
+    """Return one page of history records, newest first, and the cursor for the next page.
+
+    Pages are keyed on (tarikh, masa_sampai, id) rather than OFFSET so deep
+    pages cost the same as the first one.
+    """
+    page_size = page_size or app.config['HISTORY_PAGE_SIZE']
+
+    query = KehadiranLewat.query.join(
+        Murid, Murid.id == KehadiranLewat.murid_id
+    ).join(
+        Kelas, Kelas.id == Murid.kelas_id
+    ).options(
+        contains_eager(KehadiranLewat.murid).contains_eager(Murid.kelas),
+        joinedload(KehadiranLewat.category)
+    )
+    query = apply_history_filters(query, filters, period)
+
+    if after:
+        tarikh, masa_sampai, record_id = after
+        query = query.filter(or_(
+            KehadiranLewat.tarikh < tarikh,
+            and_(KehadiranLewat.tarikh == tarikh, or_(
+                KehadiranLewat.masa_sampai < masa_sampai,
+                and_(KehadiranLewat.masa_sampai == masa_sampai, KehadiranLewat.id < record_id)
+            ))
+        ))
+
+    records = query.order_by(
+        KehadiranLewat.tarikh.desc(),
+        KehadiranLewat.masa_sampai.desc(),
+        KehadiranLewat.id.desc()
+    ).limit(page_size + 1).all()
+
+    if len(records) > page_size:
+        records = records[:page_size]
+        return records, encode_history_cursor(records[-1])
+    return records, None
+
+def get_history_totals(filters, period):
+    query = db.session.query(
+        Murid.jantina,
+        func.count(KehadiranLewat.id)
+    ).select_from(KehadiranLewat).join(
+        Murid, Murid.id == KehadiranLewat.murid_id
+    ).join(
+        Kelas, Kelas.id == Murid.kelas_id
+    )
+    counts = dict(apply_history_filters(query, filters, period).group_by(Murid.jantina).all())
+
+    return {
+        'total': sum(counts.values()),
+        'lelaki': counts.get('Lelaki', 0),
+        'perempuan': counts.get('Perempuan', 0)
+    }
+
+def get_page_size():
+    page_size = request.args.get('per_page', app.config['HISTORY_PAGE_SIZE'], type=int)
+    return max(1, min(page_size, HISTORY_MAX_PAGE_SIZE))
+
+def get_id_list(field):
+    """Read integer ids from a form field sent either repeated or comma-separated."""
+    ids = []
+    for value in request.form.getlist(field):
+        for part in value.split(','):
+            part = part.strip()
+            if part.isdigit():
+                ids.append(int(part))
+    return ids
+
+# Denda board. Like history, pages are keyed on (tarikh, id) so every page
+# is a range scan of ix_denda_status_tarikh.
+
+DENDA_STATUSES = ('pending', 'completed')
+
+def get_denda_filters():
+    filters = {
+        'status': request.args.get('status', 'pending'),
+        'month': request.args.get('month', type=int),
+        'year': request.args.get('year', type=int),
+        'kelas_id': request.args.get('kelas_id', type=int)
+    }
+    if filters['month'] not in range(1, 13):
+        filters['month'] = None
+    if not is_valid_month(filters['month'] or 1, filters['year']):
+        filters['year'] = None
+    return filters
+
+def apply_denda_filters(query, filters, with_status=True):
+    """Filter a Denda query that already joins Murid."""
+    if with_status and filters['status'] in DENDA_STATUSES:
+        query = query.filter(Denda.status == filters['status'])
+
+    if filters['year'] and filters['month']:
+        query = query.filter(in_period(*month_range(filters['year'], filters['month']), column=Denda.tarikh))
+    elif filters['year']:
+        query = query.filter(in_period(date(filters['year'], 1, 1), date(filters['year'] + 1, 1, 1),
+                                       column=Denda.tarikh))
+
+    if filters['kelas_id']:
+        query = query.filter(Murid.kelas_id == filters['kelas_id'])
+
+    return query
+
+def encode_denda_cursor(denda):
+    return f"{denda.tarikh.isoformat()}|{denda.id}"
+
+def decode_denda_cursor(cursor):
+    try:
+        tarikh, denda_id = cursor.split('|')
+        return date.fromisoformat(tarikh), int(denda_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_denda_page(filters, after=None, page_size=None):
+    """Return one page of denda, newest first, and the cursor for the next page."""
+    page_size = page_size or app.config['HISTORY_PAGE_SIZE']
+
+    query = Denda.query.join(
+        Murid, Murid.id == Denda.murid_id
+    ).options(
+        contains_eager(Denda.murid).joinedload(Murid.kelas)
+    )
+    query = apply_denda_filters(query, filters)
+
+    if after:
+        tarikh, denda_id = after
+        query = query.filter(or_(
+            Denda.tarikh < tarikh,
+            and_(Denda.tarikh == tarikh, Denda.id < denda_id)
+        ))
+
+    records = query.order_by(Denda.tarikh.desc(), Denda.id.desc()).limit(page_size + 1).all()
+
+    if len(records) > page_size:
+        records = records[:page_size]
+        return records, encode_denda_cursor(records[-1])
+    return records, None
+
+def count_denda_by_status(filters):
+    query = db.session.query(Denda.status, func.count(Denda.id)).join(Murid, Murid.id == Denda.murid_id)
+    counts = dict(apply_denda_filters(query, filters, with_status=False).group_by(Denda.status).all())
+    return {status: counts.get(status, 0) for status in DENDA_STATUSES}
+
+def assign_denda_batch(murid_ids, jenis_denda, nota):
+    """Give every student the same denda, DENDA_CHUNK_SIZE rows per INSERT; returns the row count."""
+    today = date.today()
+    now = datetime.utcnow()
+    rows = [{
+        'murid_id': murid_id,
+        'jenis_denda': jenis_denda,
+        'tarikh': today,
+        'status': 'pending',
+        'nota': nota,
+        'assigned_by': current_user.id,
+        'created_at': now
+    } for murid_id in dict.fromkeys(murid_ids)]
+    for start in range(0, len(rows), DENDA_CHUNK_SIZE):
+        db.session.execute(insert(Denda).values(rows[start:start + DENDA_CHUNK_SIZE]))
+    return len(rows)
+
+def complete_denda_batch(denda_ids):
+    """Mark pending denda completed with one UPDATE; returns how many changed."""
+    return db.session.execute(update(Denda).where(
+        Denda.id.in_(denda_ids), Denda.status == 'pending'
+    ).values(status='completed', completed_at=datetime.utcnow()).execution_options(
+        synchronize_session=False
+    )).rowcount
+
+_surat_pool = None
+_surat_pool_lock = threading.Lock()
+
+def get_surat_pool():
+    global _surat_pool
+    with _surat_pool_lock:
+        if _surat_pool is None:
+            _surat_pool = ProcessPoolExecutor(max_workers=app.config['SURAT_WORKERS'])
+    return _surat_pool
+
+def render_surat_batch(surat_list):
+    if app.config['SURAT_WORKERS'] <= 1 or len(surat_list) < SURAT_POOL_MIN_BATCH:
+        return [render_surat(item) for item in surat_list]
+    return list(get_surat_pool().map(render_surat, surat_list, chunksize=4))
+
+def surat_date(month, year):
+    """Letters for a closed month are dated the first day of the next month.
+
+    The date is then fixed, so the letter only needs rendering again when
+    the month's records change.
+    """
+    today = date.today()
+    if (year, month) < (today.year, today.month):
+        return month_range(year, month)[1]
+    return today
+
+def get_surat_data(murid_ids, month, year, guru_name=None):
+    """Collect letter data for several students in one query, ordered by name."""
+    start, end = month_range(year, month)
+    if guru_name is None:
+        guru_name = current_user.nama_guru or current_user.username
+    tarikh_surat = surat_date(month, year)
+
+    rows = db.session.query(
+        Murid.id,
+        Murid.nama_penuh,
+        Kelas.nama_kelas,
+        KehadiranLewat.tarikh,
+        KehadiranLewat.masa_sampai
+    ).join(Kelas, Kelas.id == Murid.kelas_id).outerjoin(
+        KehadiranLewat, and_(KehadiranLewat.murid_id == Murid.id, in_period(start, end))
+    ).filter(
+        Murid.id.in_(murid_ids)
+    ).order_by(Murid.nama_penuh, Murid.id, KehadiranLewat.tarikh).all()
+
+    surat_list = []
+    for row in rows:
+        if not surat_list or surat_list[-1]['murid_id'] != row.id:
+            surat_list.append({
+                'murid_id': row.id,
+                'nama_penuh': row.nama_penuh,
+                'nama_kelas': row.nama_kelas,
+                'month': month,
+                'year': year,
+                'guru_name': guru_name,
+                'tarikh_surat': tarikh_surat,
+                'kehadiran': []
+            })
+        if row.tarikh is not None:
+            surat_list[-1]['kehadiran'].append((row.tarikh, row.masa_sampai))
+
+    return surat_list
+
+# Rendered artifacts. Reports and letters for closed periods are stored in
+# artifact_store under a hash of their inputs; see artifacts.py. The open
+# month changes with every check-in, so its files are rendered on each
+# request and never stored. send_file takes either a path or a file object.
+
+artifact_store = ArtifactStore(app.config['ARTIFACT_DIR'])
+
+def get_surat_files(surat_list, month, year):
+    """One rendered letter per item, rendering only the ones not stored yet."""
+    if is_open_period(month_range(year, month)[1]):
+        return [io.BytesIO(content) for content in render_surat_batch(surat_list)]
+    return artifact_store.get_or_render_many('surat', '.docx', surat_list, render_surat_batch)
+
+def get_surat_merged_file(surat_list, month, year):
+    if is_open_period(month_range(year, month)[1]):
+        return io.BytesIO(render_surat_merged(surat_list))
+    return artifact_store.get_or_render('surat_gabung', '.docx', surat_list, render_surat_merged)
+
+def prune_artifacts(max_mb=None, max_age_days=None):
+    """Prune the store, by default to ARTIFACT_MAX_MB and ARTIFACT_MAX_AGE_DAYS.
+
+    Returns (files removed, bytes freed).
+    """
+    if max_mb is None:
+        max_mb = app.config['ARTIFACT_MAX_MB']
+    if max_age_days is None:
+        max_age_days = app.config['ARTIFACT_MAX_AGE_DAYS']
+    return artifact_store.prune(max_bytes=max_mb * 1024 * 1024, max_age=max_age_days * 86400)
+
+# PDF reports are streamed: rows come from the database LAPORAN_CHUNK_SIZE
+# at a time and go straight onto the page in a single pass.
+
+LAPORAN_GROUPS = ('tarikh', 'kelas')
+
+def get_laporan_period(filter_type, month, year):
+    """(start, end, subtitle, filename label) for a monthly or academic-year report."""
+    if filter_type == 'academic':
+        label = academic_year_label(year)
+        return (*academic_year_range(year), f"Sesi {label}", f"Sesi_{label.replace('/', '_')}")
+    return (*month_range(year, month), f"Bulan: {BULAN_NAMES[month]} {year}", f"{month}_{year}")
+
+def laporan_query(start, end, group):
+    query = db.session.query(
+        KehadiranLewat.tarikh,
+        KehadiranLewat.masa_sampai,
+        Murid.nama_penuh,
+        Kelas.nama_kelas,
+        Murid.jantina,
+        Tingkatan.nama
+    ).join(
+        Murid, Murid.id == KehadiranLewat.murid_id
+    ).join(
+        Kelas, Kelas.id == Murid.kelas_id
+    ).join(
+        Tingkatan, Tingkatan.id == Kelas.tingkatan_id
     ).filter(
-        extract('month', KehadiranLewat.tarikh) == month,
-        extract('year', KehadiranLewat.tarikh) == year
-    ).group_by(KehadiranLewat.murid_id).having(func.count(KehadiranLewat.id) >= 3).subquery()
+        in_period(start, end)
+    )
+    if group == 'kelas':
+        query = query.order_by(Tingkatan.id, Kelas.nama_kelas, Kelas.id)
+    return query.order_by(KehadiranLewat.tarikh, KehadiranLewat.masa_sampai, KehadiranLewat.id)
 
-    murid_list = db.session.query(Murid, subquery.c.count).join(
-        subquery, Murid.id == subquery.c.murid_id
-    ).options(joinedload(Murid.kelas)).all()
+def iter_laporan_rows(query):
+    for row in query.yield_per(LAPORAN_CHUNK_SIZE):
+        yield tuple(row)
 
-    result = []
-    for murid, count in murid_list:
-        kehadiran = KehadiranLewat.query.filter(
-            KehadiranLewat.murid_id == murid.id,
-            extract('month', KehadiranLewat.tarikh) == month,
-            extract('year', KehadiranLewat.tarikh) == year
-        ).order_by(KehadiranLewat.tarikh).all()
+def get_laporan_totals(start, end):
+    counts = dict(db.session.query(Murid.jantina, func.count(KehadiranLewat.id)).join(
+        Murid, Murid.id == KehadiranLewat.murid_id
+    ).filter(
+        in_period(start, end)
+    ).group_by(Murid.jantina).all())
+    return {'jumlah': sum(counts.values()), **counts}
+
+def get_laporan_pdf(filter_type, month, year, group='tarikh'):
+    """A PDF report: a stored path for a closed period, else a temporary file.
+
+    A closed period's report is keyed on the history version, so it is
+    rendered again only after a write that could change it.
+    """
+    start, end, subtitle, _ = get_laporan_period(filter_type, month, year)
+
+    def render_to(f):
+        render_laporan_pdf(f, iter_laporan_rows(laporan_query(start, end, group)),
+                           'Laporan Kehadiran Lewat', subtitle, get_laporan_totals(start, end), group)
+
+    if is_open_period(end):
+        f = tempfile.TemporaryFile()
+        render_to(f)
+        f.seek(0)
+        return f
+
+    key = artifact_store.key('laporan_pdf', {
+        'period': [filter_type, month, year], 'group': group,
+        'versi': get_data_version(HISTORY_VERSION_ID).versi
+    })
+    return artifact_store.get_or_write(key, '.pdf', render_to)
+
+# Report jobs. The report_job table is the queue. Any process can add a
+# row; a worker claims it with a conditional UPDATE, so the ReportWorker
+# threads in every server process share one queue without a broker and
+# never run a job twice. At the start of each month the worker queues the
+# closed month's PDF report and surat amaran.
+
+REPORT_JOB_TYPES = ('laporan_pdf', 'surat')
+
+def previous_month(day=None):
+    day = day or date.today()
+    if day.month == 1:
+        return 12, day.year - 1
+    return day.month - 1, day.year
+
+def enqueue_report_jobs(month, year, force=False):
+    """Queue every report job for the month; with force, queue finished ones again."""
+    stmt = dialect_insert(ReportJob).values([{
+        'jenis': jenis,
+        'bulan': month,
+        'tahun': year,
+        'status': 'pending',
+        'created_at': datetime.utcnow()
+    } for jenis in REPORT_JOB_TYPES])
+    if force:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['jenis', 'tahun', 'bulan'],
+            set_={'status': 'pending', 'error': None, 'started_at': None, 'finished_at': None}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['jenis', 'tahun', 'bulan'])
+    db.session.execute(stmt)
+    db.session.commit()
 
-        result.append({
-            'murid': murid,
-            'count': count,
-            'kehadiran': kehadiran
-        })
+def claim_report_job():
+    """Take the oldest waiting job, or one whose worker died; None when there is none."""
+    stale = datetime.utcnow() - timedelta(seconds=app.config['REPORT_JOB_TIMEOUT'])
+    waiting = or_(
+        ReportJob.status == 'pending',
+        and_(ReportJob.status == 'running', ReportJob.started_at < stale)
+    )
+    while True:
+        job_id = db.session.query(ReportJob.id).filter(waiting).order_by(ReportJob.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        claimed = db.session.execute(update(ReportJob).where(
+            ReportJob.id == job_id, waiting
+        ).values(status='running', started_at=datetime.utcnow()).execution_options(
+            synchronize_session=False
+        )).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(ReportJob, job_id)
+        # Another worker took it first
+
+def get_duty_users(day=None):
+    """Users on duty on day, or every user when no duty dates are set."""
+    day = day or date.today()
+    users = list(get_users().values())
+    on_duty = [u for u in users
+               if u.bertugas_dari and u.bertugas_hingga and u.bertugas_dari <= day <= u.bertugas_hingga]
+    return on_duty or users
+
+def run_report_job(job):
+    if job.jenis == 'laporan_pdf':
+        get_laporan_pdf('monthly', job.bulan, job.tahun)
+    elif job.jenis == 'surat':
+        # Letters carry the teacher's name, so render a set for each teacher on duty
+        murid_ids = get_warning_murid_ids(job.bulan, job.tahun)
+        guru_names = dict.fromkeys(u.nama_guru or u.username for u in get_duty_users())
+        for guru_name in guru_names:
+            surat_list = get_surat_data(murid_ids, job.bulan, job.tahun, guru_name) if murid_ids else []
+            get_surat_files(surat_list, job.bulan, job.tahun)
+    else:
+        raise ValueError(f'Jenis kerja tidak dikenali: {job.jenis}')
+
+def run_report_jobs():
+    """Run waiting jobs until none are left; returns how many ran."""
+    count = 0
+    while True:
+        job = claim_report_job()
+        if job is None:
+            return count
+        try:
+            run_report_job(job)
+            job.status = 'done'
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception('Kerja laporan %s %d/%d gagal', job.jenis, job.bulan, job.tahun)
+            job.status = 'failed'
+            job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        count += 1
+
+class ReportWorker:
+    """Background thread that queues each closed month's reports, runs report
+    jobs and prunes the artifact store."""
+
+    def __init__(self):
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._scheduled = None
+        self._pruned_at = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='report-worker', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                app.logger.exception('Pekerja laporan gagal')
+            self._stop.wait(app.config['REPORT_WORKER_INTERVAL'])
+
+    def run_once(self):
+        with app.app_context():
+            month = previous_month()
+            if self._scheduled != month:
+                enqueue_report_jobs(*month)
+                self._scheduled = month
+            ran = run_report_jobs()
+
+        now = time.monotonic()
+        if self._pruned_at is None or now - self._pruned_at >= app.config['ARTIFACT_PRUNE_INTERVAL']:
+            self._pruned_at = now
+            prune_artifacts()
+        return ran
+
+report_worker = ReportWorker()
+
+# Student search. SQLite keeps an FTS5 index on murid up to date through
+# triggers; Postgres uses pg_trgm GIN indexes. Either way the database keeps
+# the index current on every add, edit, delete and pindah, in every worker.
+# Without either, search falls back to a LIKE scan.
+
+murid_fts = table('murid_fts', column('rowid'), column('rank'))
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS murid_fts USING fts5("
+    "nama_penuh, ic, content='murid', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS murid_fts_ai AFTER INSERT ON murid BEGIN "
+    "INSERT INTO murid_fts(rowid, nama_penuh, ic) VALUES (new.id, new.nama_penuh, new.ic); END",
+    "CREATE TRIGGER IF NOT EXISTS murid_fts_ad AFTER DELETE ON murid BEGIN "
+    "INSERT INTO murid_fts(murid_fts, rowid, nama_penuh, ic) VALUES ('delete', old.id, old.nama_penuh, old.ic); END",
+    "CREATE TRIGGER IF NOT EXISTS murid_fts_au AFTER UPDATE OF nama_penuh, ic ON murid BEGIN "
+    "INSERT INTO murid_fts(murid_fts, rowid, nama_penuh, ic) VALUES ('delete', old.id, old.nama_penuh, old.ic); "
+    "INSERT INTO murid_fts(rowid, nama_penuh, ic) VALUES (new.id, new.nama_penuh, new.ic); END",
+]
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_murid_nama_trgm ON murid "
+    "USING gin (lower(nama_penuh) gin_trgm_ops) WHERE is_deleted = false",
+    "CREATE INDEX IF NOT EXISTS ix_murid_ic_trgm ON murid "
+    "USING gin (ic gin_trgm_ops) WHERE is_deleted = false",
+]
+
+_search_backend = None
+
+def setup_murid_search():
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            exists = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'murid_fts'"
+            )).first()
+            for statement in SQLITE_SEARCH_DDL:
+                db.session.execute(text(statement))
+            if not exists:
+                db.session.execute(text("INSERT INTO murid_fts(murid_fts) VALUES ('rebuild')"))
+        elif dialect == 'postgresql':
+            for statement in POSTGRES_SEARCH_DDL:
+                db.session.execute(text(statement))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.warning('Indeks carian murid tidak dapat dibina; carian menggunakan LIKE', exc_info=True)
+
+def get_search_backend():
+    global _search_backend
+    if _search_backend is None:
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            found = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'murid_fts'"
+            )).first()
+            _search_backend = 'fts5' if found else 'like'
+        elif dialect == 'postgresql':
+            found = db.session.execute(text(
+                "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_murid_nama_trgm'"
+            )).first()
+            _search_backend = 'trgm' if found else 'like'
+        else:
+            _search_backend = 'like'
+    return _search_backend
+
+def search_murid(query, limit=10):
+    """Ranked prefix search on nama_penuh and IC over students not deleted.
+
+    Every word in the query must start a word in the name or the IC. Names
+    that begin with the query come first, then the best text match.
+    """
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return []
+
+    nama = func.lower(Murid.nama_penuh)
+    phrase = ' '.join(terms)
+
+    rows = db.session.query(
+        Murid.id, Murid.nama_penuh, Murid.ic, Kelas.nama_kelas, Murid.jantina
+    ).join(Kelas, Kelas.id == Murid.kelas_id).filter(Murid.is_deleted == False)
+
+    ic = normalise_ic(query)
+    if get_search_backend() == 'fts5':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # ICs are stored without dashes, so "081211-09" splits into terms
+        # no IC token starts with; match its normal form as one prefix too
+        match = f'({match}) OR ic : "{ic}"*'
+        rows = rows.join(murid_fts, murid_fts.c.rowid == Murid.id).filter(
+            text('murid_fts MATCH :match').bindparams(match=match)
+        ).order_by(
+            case((nama.startswith(phrase), 0), (Murid.ic.startswith(ic), 0), else_=1),
+            murid_fts.c.rank,
+            Murid.nama_penuh
+        )
+    else:
+        conditions = [or_(nama.startswith(term), nama.contains(f' {term}')) for term in terms]
+        rows = rows.filter(or_(and_(*conditions), Murid.ic.startswith(ic) if ic else False)).order_by(
+            case((nama.startswith(phrase), 0), (Murid.ic.startswith(ic), 0), else_=1),
+            Murid.nama_penuh
+        )
+
+    return rows.limit(limit).all()
+
+# Roster import. Files are read in chunks, validated column-wise with
+# pandas and upserted on the IC unique index in one transaction.
+
+ROSTER_COLUMN_ALIASES = {
+    'nama': 'nama_penuh',
+    'nama_murid': 'nama_penuh',
+    'no_ic': 'ic',
+    'no_kp': 'ic',
+    'nama_kelas': 'kelas',
+    'no_telefon': 'no_ibu_bapa',
+    'no_tel_ibu_bapa': 'no_ibu_bapa'
+}
+ROSTER_REQUIRED_COLUMNS = ['nama_penuh', 'ic', 'jantina', 'kelas']
+JANTINA_VALUES = {'lelaki': 'Lelaki', 'l': 'Lelaki', 'perempuan': 'Perempuan', 'p': 'Perempuan'}
+
+# pandas, numpy, python-docx and reportlab are imported inside the
+# functions that use them. Only imports, surat and PDF exports need them,
+# and loading them up front made every worker start noticeably slower.
+
+def read_roster_chunks(stream, filename):
+    import pandas as pd
+
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        frame = pd.read_excel(stream, dtype=str)
+        for start in range(0, len(frame), IMPORT_CHUNK_SIZE):
+            yield frame.iloc[start:start + IMPORT_CHUNK_SIZE]
+    else:
+        yield from pd.read_csv(stream, dtype=str, chunksize=IMPORT_CHUNK_SIZE, encoding='utf-8-sig')
+
+def normalise_roster_column(name):
+    name = str(name).strip().lower().replace(' ', '_')
+    return ROSTER_COLUMN_ALIASES.get(name, name)
+
+def validate_roster_chunk(chunk, kelas_ids, seen_ic):
+    """Clean one chunk; returns (frame, reasons) with '' for valid rows."""
+    import numpy as np
+    import pandas as pd
+
+    raw = {name: chunk[name].fillna('').astype(str).str.strip() for name in chunk.columns}
+
+    frame = pd.DataFrame({
+        'nama_penuh': raw['nama_penuh'],
+        'ic': raw['ic'].str.replace(r'[^0-9A-Za-z]', '', regex=True).str.upper(),
+        'jantina': raw['jantina'].str.lower().map(JANTINA_VALUES),
+        'kelas_id': raw['kelas'].str.lower().map(kelas_ids)
+    }, index=chunk.index)
+    if 'no_ibu_bapa' in raw:
+        frame['no_ibu_bapa'] = raw['no_ibu_bapa']
+
+    reasons = np.select([
+        frame['nama_penuh'].eq(''),
+        raw['ic'].eq(''),
+        ~frame['ic'].str.match(app.config['IC_PATTERN']),
+        raw['jantina'].eq(''),
+        frame['jantina'].isna(),
+        raw['kelas'].eq(''),
+        frame['kelas_id'].isna(),
+        frame['ic'].duplicated() | frame['ic'].isin(seen_ic)
+    ], [
+        'Nama penuh kosong',
+        'IC kosong',
+        'Format IC tidak sah',
+        'Jantina kosong',
+        'Jantina mesti Lelaki atau Perempuan',
+        'Kelas kosong',
+        'Kelas tidak wujud',
+        'IC berulang dalam fail'
+    ], default='')
+
+    return frame, pd.Series(reasons, index=chunk.index)
+
+def upsert_murid_batch(records):
+    """Insert or update students keyed on IC; returns how many were new."""
+    existing = [murid_id for (murid_id,) in db.session.query(Murid.id).filter(
+        Murid.ic.in_([r['ic'] for r in records])
+    )]
+
+    # An updated row can change kelas and jantina; move the rollup with it
+    if existing:
+        shift_rumusan_harian(existing, -1)
+    stmt = dialect_insert(Murid).values(records)
+    updates = {
+        'nama_penuh': stmt.excluded.nama_penuh,
+        'jantina': stmt.excluded.jantina,
+        'kelas_id': stmt.excluded.kelas_id,
+        'is_deleted': False
+    }
+    if 'no_ibu_bapa' in records[0]:
+        updates['no_ibu_bapa'] = stmt.excluded.no_ibu_bapa
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['ic'], set_=updates))
+    if existing:
+        shift_rumusan_harian(existing, 1)
+
+    return len(records) - len(existing)
+
+def import_murid_roster(stream, filename):
+    """Import a CSV/XLSX roster. Row numbers in the result match the spreadsheet."""
+    kelas_ids = {nama.strip().lower(): kelas_id for kelas_id, nama in db.session.query(Kelas.id, Kelas.nama_kelas)}
+    result = {'inserted': 0, 'updated': 0, 'rejected': []}
+    seen_ic = set()
+
+    try:
+        for chunk in read_roster_chunks(stream, filename):
+            chunk = chunk.rename(columns=normalise_roster_column)
+            missing = [name for name in ROSTER_REQUIRED_COLUMNS if name not in chunk.columns]
+            if missing:
+                raise ValueError(f"Lajur tiada dalam fail: {', '.join(missing)}")
+
+            frame, reasons = validate_roster_chunk(chunk, kelas_ids, seen_ic)
+            valid = reasons.eq('')
+
+            for index, reason in reasons[~valid].items():
+                # +2: pandas index starts at 0 and the spreadsheet has a header row
+                result['rejected'].append({'row': index + 2, 'ic': frame.at[index, 'ic'], 'reason': reason})
+
+            accepted = frame[valid].astype({'kelas_id': int})
+            seen_ic.update(accepted['ic'])
+            records = accepted.to_dict('records')
+
+            for start in range(0, len(records), IMPORT_BATCH_SIZE):
+                batch = records[start:start + IMPORT_BATCH_SIZE]
+                inserted = upsert_murid_batch(batch)
+                result['inserted'] += inserted
+                result['updated'] += len(batch) - inserted
+
+        bump_data_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
 
     return result
 
+DEFAULT_CATEGORY_KEYWORDS = {
+    'Iklim/Cuaca': 'hujan,panas,ribut,banjir,kilat,petir,sejuk,lebat,cuaca',
+    'Masalah Keluarga': 'sakit,hospital,kecemasan,emergency,ibu,bapa,adik,kakak,nenek,datuk,hantar,penghantar,keluarga,rumah',
+    'Masalah Transport': 'jalan,sesak,jam,traffic,kereta,motor,motosikal,bas,rosak,pancit,tayar,minyak,kemalangan,accident,kenderaan',
+    'Lain-lain': ''
+}
+
+LEGACY_CATEGORY_KEYWORDS = {
+    'Iklim/Cuaca': 'hujan,panas,ribut,banjir,kilat,petir,sejuk',
+    'Masalah Keluarga': 'sakit,hospital,ibu,bapa,keluarga,emergency',
+    'Masalah Transport': 'jalan,sesak,kereta,motor,pancit,rosak,traffic'
+}
+
+def index_exists(name):
+    if db.engine.dialect.name == 'postgresql':
+        sql = "SELECT 1 FROM pg_indexes WHERE indexname = :name"
+    else:
+        sql = "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"
+    return db.session.execute(text(sql), {'name': name}).first() is not None
+
 def init_database():
     db.create_all()
 
@@ -161,6 +2198,11 @@ def init_database():
 
         db.session.commit()
 
+    for version_id in (DATA_VERSION_ID, REFERENCE_VERSION_ID, HISTORY_VERSION_ID):
+        if db.session.get(DataVersion, version_id) is None:
+            db.session.add(DataVersion(id=version_id, versi=0))
+    db.session.commit()
+
     if Tingkatan.query.count() == 0:
         for i in range(1, 6):
             tingkatan = Tingkatan(nama=f'Tingkatan {i}')
@@ -168,18 +2210,207 @@ def init_database():
         db.session.commit()
 
     if CategoryAlasan.query.count() == 0:
-        categories = [
-            CategoryAlasan(nama='Iklim/Cuaca', keywords='hujan,panas,ribut,banjir,kilat,petir,sejuk'),
-            CategoryAlasan(nama='Masalah Keluarga', keywords='sakit,hospital,ibu,bapa,keluarga,emergency'),
-            CategoryAlasan(nama='Masalah Transport', keywords='jalan,sesak,kereta,motor,pancit,rosak,traffic'),
-            CategoryAlasan(nama='Lain-lain', keywords='')
-        ]
-        for cat in categories:
-            db.session.add(cat)
+        for nama, keywords in DEFAULT_CATEGORY_KEYWORDS.items():
+            db.session.add(CategoryAlasan(nama=nama, keywords=keywords))
         db.session.commit()
+    else:
+        # Databases seeded before the classifier read keywords from the
+        # table got shorter lists than the old hardcoded ones
+        upgraded = False
+        for category in CategoryAlasan.query.all():
+            if LEGACY_CATEGORY_KEYWORDS.get(category.nama) == category.keywords:
+                category.keywords = DEFAULT_CATEGORY_KEYWORDS[category.nama]
+                upgraded = True
+        if upgraded:
+            db.session.commit()
 
-with app.app_context():
+    # create_all() skips indexes on tables that already exist
+    for index in KehadiranLewat.__table__.indexes | Murid.__table__.indexes | Denda.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+    # Rollups made before rumusan_harian had its unique key can hold
+    # duplicate rows; rebuilding merges them so the key can be created
+    if not index_exists('uq_rumusan_harian_kunci'):
+        rebuild_rumusan_harian()
+        db.session.execute(text('DROP INDEX IF EXISTS ix_rumusan_harian_kunci'))
+        db.session.commit()
+        for index in RumusanHarian.__table__.indexes:
+            index.create(bind=db.engine)
+
+    if KehadiranLewat.query.first() is not None:
+        if RumusanHarian.query.first() is None:
+            rebuild_rumusan_harian()
+        if KiraanLewatBulanan.query.first() is None:
+            rebuild_kiraan_bulanan()
+
+    # IC numbers are stored normalised so lookups can use the unique index.
+    # A legacy IC whose normal form is already taken is left for an admin.
+    rows = db.session.query(Murid.id, Murid.ic).all()
+    taken = {ic for _, ic in rows}
+    renamed = []
+    for murid_id, ic in rows:
+        normal = normalise_ic(ic)
+        if normal and normal != ic and normal not in taken:
+            taken.add(normal)
+            renamed.append({'id': murid_id, 'ic': normal})
+    if renamed:
+        db.session.execute(update(Murid), renamed)
+        db.session.commit()
+
+    setup_murid_search()
+
+def explain_query(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.connection().exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [' | '.join(str(col) for col in row) for row in rows]
+
+@app.cli.command('explain-queries')
+def explain_queries_command():
+    """Compare query plans of the old extract() filters with tarikh ranges."""
+    today = date.today()
+    start, end = month_range(today.year, today.month)
+    legacy = and_(
+        extract('month', KehadiranLewat.tarikh) == today.month,
+        extract('year', KehadiranLewat.tarikh) == today.year
+    )
+    murid_id = db.session.query(func.min(KehadiranLewat.murid_id)).scalar() or 0
+
+    checks = [
+        ('Bulanan', db.session.query(KehadiranLewat.id).filter(legacy),
+         db.session.query(KehadiranLewat.id).filter(in_period(start, end))),
+        ('Murid bulanan',
+         db.session.query(KehadiranLewat.id).filter(KehadiranLewat.murid_id == murid_id, legacy),
+         db.session.query(KehadiranLewat.id).filter(KehadiranLewat.murid_id == murid_id, in_period(start, end))),
+        ('Kategori bulanan',
+         db.session.query(KehadiranLewat.category_id, func.count(KehadiranLewat.id)).filter(legacy).group_by(KehadiranLewat.category_id),
+         db.session.query(KehadiranLewat.category_id, func.count(KehadiranLewat.id)).filter(in_period(start, end)).group_by(KehadiranLewat.category_id)),
+    ]
+
+    for label, before, after in checks:
+        print(f'== {label} ==')
+        print('Sebelum (extract):')
+        for line in explain_query(before):
+            print(f'  {line}')
+        print('Selepas (julat tarikh):')
+        for line in explain_query(after):
+            print(f'  {line}')
+
+@app.cli.command('reclassify')
+@click.option('--batch-size', default=1000, show_default=True, help='Rekod setiap kelompok.')
+def reclassify_command(batch_size):
+    """Re-categorise stored alasan after category keywords are edited."""
+    changed = reclassify_kehadiran(batch_size)
+    print(f'{changed} rekod dikategorikan semula.')
+
+@app.cli.command('rebuild-rumusan')
+def rebuild_rumusan_command():
+    """Rebuild rumusan_harian and kiraan_lewat_bulanan from raw records."""
+    rebuild_rumusan_harian()
+    rebuild_kiraan_bulanan()
+    print(f'{RumusanHarian.query.count()} baris rumusan dan '
+          f'{KiraanLewatBulanan.query.count()} kiraan bulanan dijana semula.')
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create tables, indexes and default data."""
     init_database()
+    print('Pangkalan data sedia.')
+
+@app.cli.command('report-worker')
+def report_worker_command():
+    """Run the report job worker in the foreground, e.g. as its own service."""
+    print('Pekerja laporan berjalan. Tekan Ctrl+C untuk berhenti.')
+    report_worker.run()
+
+@app.cli.command('prerender')
+@click.option('--month', type=int, help='Bulan (lalai: bulan lepas).')
+@click.option('--year', type=int, help='Tahun (lalai: tahun bagi bulan lepas).')
+def prerender_command(month, year):
+    """Render a closed month's PDF report and surat amaran into the artifact store now."""
+    default_month, default_year = previous_month()
+    month, year = month or default_month, year or default_year
+    if not is_valid_month(month, year):
+        raise click.BadParameter(f'{month}/{year}', param_hint='--month/--year')
+    if is_open_period(month_range(year, month)[1]):
+        print(f'Bulan {month}/{year} belum tamat; laporannya dijana semasa dimuat turun.')
+        return
+    enqueue_report_jobs(month, year, force=True)
+    ran = run_report_jobs()
+    print(f'{ran} kerja laporan dijalankan; {artifact_store.stats()["misses"]} fail dijana.')
+
+@app.cli.command('prune-artifacts')
+@click.option('--max-mb', type=float, help='Saiz maksimum (lalai: ARTIFACT_MAX_MB).')
+@click.option('--max-age-days', type=float, help='Buang fail tidak digunakan selama ini (lalai: ARTIFACT_MAX_AGE_DAYS).')
+def prune_artifacts_command(max_mb, max_age_days):
+    """Remove stored reports and surat that are old or over the size cap."""
+    removed, freed = prune_artifacts(max_mb, max_age_days)
+    print(f'{removed} fail dibuang, {freed / 1024 / 1024:.1f} MB dikosongkan.')
+
+def run_waitress(host, port, threads):
+    from waitress import serve
+
+    serve(app, host=host, port=port, threads=threads)
+
+def run_gunicorn(host, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    def post_fork(server, worker):
+        # Connections opened in the parent must not be shared with children
+        with app.app_context():
+            db.engine.dispose(close=False)
+        if app.config['REPORT_WORKER']:
+            report_worker.start()
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            # Whole-school PDF and surat batches can take a while
+            self.cfg.set('timeout', 120)
+            self.cfg.set('post_fork', post_fork)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+@app.cli.command('serve')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=5000, show_default=True, type=int)
+def serve_command(host, port):
+    """Run the production server: waitress on Windows, gunicorn elsewhere.
+
+    Size it with WEB_WORKERS and WEB_THREADS; they also size the database
+    pool, which is created when the app is imported. Each process gets
+    LIVE_MAX_STREAMS extra threads for /api/stream, which hold a thread
+    but no database connection. Every thread can serve any request, but
+    RequestSlots runs at most WEB_THREADS ordinary requests at a time,
+    so the pool is never short however many screens are open.
+    """
+    app.debug = False
+    workers = app.config['WEB_WORKERS']
+    threads = app.config['WEB_THREADS'] + app.config['LIVE_MAX_STREAMS']
+
+    try:
+        if os.name != 'nt' and importlib.util.find_spec('gunicorn'):
+            print(f'gunicorn: {workers} proses x {threads} thread '
+                  f'({app.config["LIVE_MAX_STREAMS"]} untuk skrin langsung) di http://{host}:{port}')
+            run_gunicorn(host, port, workers, threads)
+        else:
+            print(f'waitress: 1 proses x {threads} thread '
+                  f'({app.config["LIVE_MAX_STREAMS"]} untuk skrin langsung) di http://{host}:{port}')
+            if app.config['REPORT_WORKER']:
+                report_worker.start()
+            run_waitress(host, port, threads)
+    except ImportError:
+        raise click.ClickException('Pasang kebergantungan dahulu: pip install -r requirements.txt')
 
 @app.route('/')
 def index():
@@ -214,44 +2445,38 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@conditional_get
 def dashboard_overview():
-    stats = get_weekly_stats()
-
     today = date.today()
-    month = today.month
-    year = today.year
+    start, end = month_range(today.year, today.month)
 
-    monthly_stats = db.session.query(
-        extract('day', KehadiranLewat.tarikh).label('day'),
-        func.count(KehadiranLewat.id).label('count')
+    stats = get_weekly_stats()
+
+    daily = db.session.query(
+        RumusanHarian.tarikh,
+        func.sum(RumusanHarian.jumlah).label('count')
     ).filter(
-        extract('month', KehadiranLewat.tarikh) == month,
-        extract('year', KehadiranLewat.tarikh) == year
-    ).group_by(extract('day', KehadiranLewat.tarikh)).all()
+        in_period(start, end, RumusanHarian.tarikh)
+    ).group_by(RumusanHarian.tarikh).order_by(RumusanHarian.tarikh).all()
+    monthly_stats = [(tarikh.day, count) for tarikh, count in daily]
 
     category_stats = db.session.query(
         CategoryAlasan.nama,
-        func.count(KehadiranLewat.id).label('count')
-    ).join(KehadiranLewat, CategoryAlasan.id == KehadiranLewat.category_id).filter(
-        extract('month', KehadiranLewat.tarikh) == month,
-        extract('year', KehadiranLewat.tarikh) == year
+        func.sum(RumusanHarian.jumlah).label('count')
+    ).join(RumusanHarian, CategoryAlasan.id == RumusanHarian.category_id).filter(
+        in_period(start, end, RumusanHarian.tarikh)
     ).group_by(CategoryAlasan.nama).all()
 
     top_kelas = db.session.query(
         Kelas.nama_kelas,
-        func.count(KehadiranLewat.id).label('count')
-    ).join(Murid, Kelas.id == Murid.kelas_id).join(
-        KehadiranLewat, Murid.id == KehadiranLewat.murid_id
-    ).filter(
-        extract('month', KehadiranLewat.tarikh) == month,
-        extract('year', KehadiranLewat.tarikh) == year
-    ).group_by(Kelas.nama_kelas).order_by(func.count(KehadiranLewat.id).desc()).limit(5).all()
+        func.sum(RumusanHarian.jumlah).label('count')
+    ).join(RumusanHarian, Kelas.id == RumusanHarian.kelas_id).filter(
+        in_period(start, end, RumusanHarian.tarikh)
+    ).group_by(Kelas.nama_kelas).order_by(func.sum(RumusanHarian.jumlah).desc()).limit(5).all()
 
-    warnings_count = len(get_murid_with_warnings())
+    warnings_count = count_murid_with_warnings()
 
-    recent_checkins = KehadiranLewat.query.options(
-        joinedload(KehadiranLewat.murid)
-    ).order_by(KehadiranLewat.created_at.desc()).limit(10).all()
+    recent_checkins = get_recent_checkins()
 
     return render_template('dashboard_overview.html',
                          stats=stats,
@@ -264,9 +2489,12 @@ def dashboard_overview():
 
 @app.route('/dashboard/amaran')
 @login_required
+@conditional_get
 def dashboard_amaran():
     month = request.args.get('month', date.today().month, type=int)
     year = request.args.get('year', date.today().year, type=int)
+    if not is_valid_month(month, year):
+        abort(400)
 
     warnings = get_murid_with_warnings(month, year)
 
@@ -291,46 +2519,23 @@ def dashboard_checkin():
         now = datetime.now()
 
         if murid_id:
-            murid = Murid.query.get(murid_id)
+            murid = db.session.query(
+                Murid.id, Murid.nama_penuh, Murid.kelas_id, Murid.jantina
+            ).filter(Murid.id == murid_id).first()
+        elif nama_penuh and normalise_ic(ic) and jantina and kelas_id:
+            murid = get_or_create_murid(nama_penuh, ic, jantina, kelas_id)
         else:
-            existing = Murid.query.filter(
-                func.lower(Murid.ic) == ic.lower()
-            ).first()
+            murid = None
 
-            if existing:
-                murid = existing
-            else:
-                murid = Murid(
-                    nama_penuh=nama_penuh,
-                    ic=ic,
-                    jantina=jantina,
-                    kelas_id=kelas_id
-                )
-                db.session.add(murid)
-                db.session.flush()
+        if murid is None:
+            flash('Sila pilih murid atau isi semua maklumat murid baru.', 'danger')
+            return redirect(url_for('dashboard_checkin'))
 
-        category = get_category_by_reason(alasan)
-
-        kehadiran = KehadiranLewat(
-            murid_id=murid.id,
-            tarikh=now.date(),
-            masa_sampai=now.time(),
-            minit_lewat=minit_lewat,
-            alasan=alasan,
-            category_id=category.id if category else None,
-            nota=nota,
-            checked_by=current_user.id
-        )
-        db.session.add(kehadiran)
+        count_this_month = record_checkin(murid, now, minit_lewat, alasan, nota)
+        log_activity('checkin', f'Check-in murid: {murid.nama_penuh}', commit=False)
         db.session.commit()
-
-        log_activity('checkin', f'Check-in murid: {murid.nama_penuh}')
-
-        count_this_month = KehadiranLewat.query.filter(
-            KehadiranLewat.murid_id == murid.id,
-            extract('month', KehadiranLewat.tarikh) == now.month,
-            extract('year', KehadiranLewat.tarikh) == now.year
-        ).count()
+        weekly_stats_cache.invalidate()
+        publish_checkin_update()
 
         if count_this_month == 3:
             flash(f'AMARAN: {murid.nama_penuh} telah lewat 3 kali bulan ini!', 'warning')
@@ -339,112 +2544,181 @@ def dashboard_checkin():
 
         return redirect(url_for('dashboard_checkin'))
 
-    tingkatan_list = Tingkatan.query.all()
-    kelas_list = Kelas.query.all()
-    categories = CategoryAlasan.query.all()
+    tingkatan_list = get_tingkatan_list()
+    kelas_list = get_kelas_list()
+    categories = get_categories()
 
     return render_template('dashboard_checkin.html',
                          tingkatan_list=tingkatan_list,
                          kelas_list=kelas_list,
                          categories=categories)
 
+@app.route('/api/checkin/batch', methods=['POST'])
+@login_required
+def api_checkin_batch():
+    payload = request.get_json(silent=True)
+    items = payload.get('checkins') if isinstance(payload, dict) else payload
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Hantar senarai checkins dalam JSON'}), 400
+    if len(items) > CHECKIN_BATCH_MAX:
+        return jsonify({'error': f'Maksimum {CHECKIN_BATCH_MAX} check-in setiap kelompok'}), 413
+
+    try:
+        results = record_checkin_batch(items)
+        created = sum(1 for r in results if r.get('status') == 'created')
+        if created:
+            log_activity('checkin_batch', f'Check-in kelompok: {created} murid', commit=False)
+        db.session.commit()
+    except IntegrityError:
+        # Another request recorded one of these keys first; a retry will
+        # report those items as duplicates
+        db.session.rollback()
+        return jsonify({'error': 'Kunci sedang diproses oleh permintaan lain, sila cuba semula'}), 409
+
+    if created:
+        weekly_stats_cache.invalidate()
+        publish_checkin_update()
+
+    return jsonify({
+        'results': results,
+        'created': created,
+        'duplicates': sum(1 for r in results if r.get('status') == 'duplicate'),
+        'errors': sum(1 for r in results if r.get('status') == 'error')
+    })
+
 @app.route('/dashboard/history')
 @login_required
 def dashboard_history():
-    filter_type = request.args.get('filter', 'weekly')
-    filter_date = request.args.get('date')
-    filter_month = request.args.get('month', type=int)
-    filter_year = request.args.get('year', type=int)
-    filter_kelas = request.args.get('kelas')
-    filter_jantina = request.args.get('jantina')
-    filter_nama = request.args.get('nama', '').strip()
+    filters = get_history_filters()
+    filter_type = filters['filter_type']
 
     today = date.today()
-    query = KehadiranLewat.query.options(
-        joinedload(KehadiranLewat.murid).joinedload(Murid.kelas),
-        joinedload(KehadiranLewat.category)
-    )
+    period = get_period_range(filter_type, filters['month'], filters['year'], filters['date'])
 
     if filter_type == 'weekly':
-        start_of_week = today - timedelta(days=today.weekday())
-        query = query.filter(KehadiranLewat.tarikh >= start_of_week)
-        date_range = f"{start_of_week.strftime('%d/%m/%Y')} - {today.strftime('%d/%m/%Y')}"
+        date_range = f"{period[0].strftime('%d/%m/%Y')} - {today.strftime('%d/%m/%Y')}"
     elif filter_type == 'monthly':
-        if filter_month and filter_year:
-            query = query.filter(
-                extract('month', KehadiranLewat.tarikh) == filter_month,
-                extract('year', KehadiranLewat.tarikh) == filter_year
-            )
-            date_range = f"{filter_month}/{filter_year}"
+        if filters['month'] and filters['year']:
+            date_range = f"{filters['month']}/{filters['year']}"
         else:
-            query = query.filter(
-                extract('month', KehadiranLewat.tarikh) == today.month,
-                extract('year', KehadiranLewat.tarikh) == today.year
-            )
             date_range = today.strftime('%B %Y')
-    elif filter_type == 'date' and filter_date:
-        try:
-            specific_date = datetime.strptime(filter_date, '%Y-%m-%d').date()
-            query = query.filter(KehadiranLewat.tarikh == specific_date)
-            date_range = specific_date.strftime('%d/%m/%Y')
-        except:
-            date_range = "Tarikh tidak sah"
+    elif filter_type == 'academic':
+        date_range = f"Sesi {academic_year_label(period[0].year)}"
+    elif filter_type == 'date' and filters['date']:
+        date_range = period[0].strftime('%d/%m/%Y') if period else "Tarikh tidak sah"
     else:
         date_range = "Semua rekod"
 
-    if filter_kelas:
-        query = query.join(Murid).join(Kelas).filter(Kelas.nama_kelas == filter_kelas)
-
-    if filter_jantina:
-        if not filter_kelas:
-            query = query.join(Murid)
-        query = query.filter(Murid.jantina == filter_jantina)
-
-    if filter_nama:
-        if not filter_kelas and not filter_jantina:
-            query = query.join(Murid)
-        query = query.filter(func.lower(Murid.nama_penuh).contains(filter_nama.lower()))
+    after = decode_history_cursor(request.args.get('after'))
+    records, next_cursor = get_history_page(filters, period, after, get_page_size())
+    totals = get_history_totals(filters, period)
 
-    records = query.order_by(KehadiranLewat.tarikh.desc(), KehadiranLewat.masa_sampai.desc()).all()
-
-    total = len(records)
-    lelaki = sum(1 for r in records if r.murid.jantina == 'Lelaki')
-    perempuan = sum(1 for r in records if r.murid.jantina == 'Perempuan')
-
-    kelas_list = Kelas.query.all()
+    kelas_list = get_kelas_list()
 
     return render_template('dashboard_history.html',
                          records=records,
+                         next_cursor=next_cursor,
                          filter_type=filter_type,
                          date_range=date_range,
-                         total=total,
-                         lelaki=lelaki,
-                         perempuan=perempuan,
+                         total=totals['total'],
+                         lelaki=totals['lelaki'],
+                         perempuan=totals['perempuan'],
                          kelas_list=kelas_list,
-                         filter_kelas=filter_kelas,
-                         filter_jantina=filter_jantina,
-                         filter_nama=filter_nama)
+                         filter_kelas=filters['kelas'],
+                         filter_jantina=filters['jantina'],
+                         filter_nama=filters['nama'])
+
+@app.route('/api/history')
+@login_required
+def api_history():
+    filters = get_history_filters()
+    period = get_period_range(filters['filter_type'], filters['month'], filters['year'], filters['date'])
+
+    after = None
+    if request.args.get('after'):
+        after = decode_history_cursor(request.args.get('after'))
+        if after is None:
+            return jsonify({'error': 'Kursor tidak sah'}), 400
+
+    records, next_cursor = get_history_page(filters, period, after, get_page_size())
+
+    return jsonify({
+        'records': [{
+            'id': r.id,
+            'tarikh': r.tarikh.strftime('%d/%m/%Y'),
+            'masa': r.masa_sampai.strftime('%H:%M'),
+            'nama_penuh': r.murid.nama_penuh,
+            'kelas': r.murid.kelas.nama_kelas,
+            'jantina': r.murid.jantina,
+            'minit_lewat': r.minit_lewat,
+            'kategori': r.category.nama if r.category else None,
+            'alasan': r.alasan,
+            'nota': r.nota
+        } for r in records],
+        'next_cursor': next_cursor
+    })
 
 @app.route('/dashboard/murid')
 @login_required
 @admin_required
 def dashboard_murid():
-    tingkatan_list = Tingkatan.query.options(
-        joinedload(Tingkatan.kelas)
-    ).all()
+    tingkatan_list = get_tingkatan_list()
+    kelas_counts = get_kelas_counts()
 
-    return render_template('dashboard_murid.html', tingkatan_list=tingkatan_list)
+    return render_template('dashboard_murid.html',
+                         tingkatan_list=tingkatan_list,
+                         kelas_counts=kelas_counts,
+                         tingkatan_counts=sum_by_tingkatan(tingkatan_list, kelas_counts))
+
+@app.route('/dashboard/murid/import', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def import_murid():
+    result = None
+
+    if request.method == 'POST':
+        upload = request.files.get('fail')
+        if not upload or not upload.filename:
+            flash('Sila pilih fail CSV atau Excel.', 'danger')
+            return redirect(url_for('import_murid'))
+
+        try:
+            result = import_murid_roster(upload.stream, upload.filename)
+        except ImportError as e:
+            # pandas names a missing openpyxl in the message, not in e.name
+            if 'openpyxl' in str(e):
+                flash('Fail Excel memerlukan pakej openpyxl. Sila pasang atau gunakan fail CSV.', 'danger')
+            else:
+                flash(f'Import murid memerlukan pakej {e.name or "pandas"}. '
+                      'Sila pasang pakej dalam requirements.txt.', 'danger')
+            return redirect(url_for('import_murid'))
+        except (ValueError, UnicodeDecodeError, zipfile.BadZipFile) as e:
+            flash(f'Fail tidak dapat dibaca: {e}', 'danger')
+            return redirect(url_for('import_murid'))
+
+        log_activity('import_murid',
+                     f"Import murid dari {upload.filename}: {result['inserted']} baru, "
+                     f"{result['updated']} dikemaskini, {len(result['rejected'])} ditolak")
+        flash(f"Import selesai: {result['inserted']} murid baru, {result['updated']} dikemaskini, "
+              f"{len(result['rejected'])} ditolak.", 'success' if not result['rejected'] else 'warning')
+
+    return render_template('dashboard_import.html', result=result)
 
 @app.route('/dashboard/murid/tingkatan/<int:tingkatan_id>')
 @login_required
 @admin_required
 def view_tingkatan(tingkatan_id):
-    tingkatan = Tingkatan.query.get_or_404(tingkatan_id)
-    kelas_list = Kelas.query.filter_by(tingkatan_id=tingkatan_id).all()
+    tingkatan = next((t for t in get_tingkatan_list() if t.id == tingkatan_id), None)
+    if tingkatan is None:
+        abort(404)
+    kelas_list = sorted(tingkatan.kelas, key=lambda k: k.id)
 
     return render_template('dashboard_tingkatan.html',
                          tingkatan=tingkatan,
-                         kelas_list=kelas_list)
+                         kelas_list=kelas_list,
+                         is_last_tingkatan=tingkatan_id == max(t.id for t in get_tingkatan_list()),
+                         kelas_counts=get_kelas_counts([k.id for k in kelas_list]))
 
 @app.route('/dashboard/murid/kelas/<int:kelas_id>')
 @login_required
@@ -452,7 +2726,7 @@ def view_tingkatan(tingkatan_id):
 def view_kelas(kelas_id):
     kelas = Kelas.query.get_or_404(kelas_id)
     murid_list = Murid.query.filter_by(kelas_id=kelas_id, is_deleted=False).all()
-    all_kelas = Kelas.query.filter(Kelas.id != kelas_id).all()
+    all_kelas = [k for k in get_kelas_list() if k.id != kelas_id]
 
     return render_template('dashboard_kelas.html',
                          kelas=kelas,
@@ -477,7 +2751,10 @@ def add_kelas():
         tingkatan_id=tingkatan_id
     )
     db.session.add(kelas)
+    bump_data_version()
+    bump_data_version(REFERENCE_VERSION_ID)
     db.session.commit()
+    reference_cache.invalidate()
 
     log_activity('add_kelas', f'Tambah kelas: {nama_kelas}')
     flash(f'Kelas {nama_kelas} berjaya ditambah.', 'success')
@@ -492,7 +2769,10 @@ def delete_kelas(kelas_id):
     nama = kelas.nama_kelas
 
     db.session.delete(kelas)
+    bump_data_version()
+    bump_data_version(REFERENCE_VERSION_ID)
     db.session.commit()
+    reference_cache.invalidate()
 
     log_activity('delete_kelas', f'Padam kelas: {nama}')
     flash(f'Kelas {nama} berjaya dipadam.', 'success')
@@ -512,7 +2792,8 @@ def add_murid():
         flash('Sila isi semua maklumat yang diperlukan.', 'danger')
         return redirect(request.referrer or url_for('dashboard_murid'))
 
-    existing = Murid.query.filter(func.lower(Murid.ic) == ic.lower()).first()
+    ic = normalise_ic(ic)
+    existing = Murid.query.filter(Murid.ic == ic).first()
     if existing:
         flash(f'Murid dengan IC {ic} sudah wujud dalam sistem.', 'warning')
         return redirect(request.referrer or url_for('dashboard_murid'))
@@ -525,6 +2806,7 @@ def add_murid():
         kelas_id=kelas_id
     )
     db.session.add(murid)
+    bump_data_version()
     db.session.commit()
 
     log_activity('add_murid', f'Tambah murid: {nama_penuh}')
@@ -536,12 +2818,20 @@ def add_murid():
 @admin_required
 def edit_murid(murid_id):
     murid = Murid.query.get_or_404(murid_id)
+    jantina = request.form.get('jantina', murid.jantina).strip()
+    jantina_changed = jantina != murid.jantina
 
+    if jantina_changed:
+        shift_rumusan_harian([murid.id], -1)
     murid.nama_penuh = request.form.get('nama_penuh', murid.nama_penuh).strip()
-    murid.ic = request.form.get('ic', murid.ic).strip()
-    murid.jantina = request.form.get('jantina', murid.jantina).strip()
+    murid.ic = normalise_ic(request.form.get('ic', murid.ic))
+    murid.jantina = jantina
     murid.no_ibu_bapa = request.form.get('no_ibu_bapa', '').strip()
+    if jantina_changed:
+        db.session.flush()
+        shift_rumusan_harian([murid.id], 1)
 
+    bump_data_version()
     db.session.commit()
 
     log_activity('edit_murid', f'Edit murid: {murid.nama_penuh}')
@@ -557,6 +2847,7 @@ def delete_murid(murid_id):
     nama = murid.nama_penuh
 
     murid.is_deleted = True
+    bump_data_version()
     db.session.commit()
 
     log_activity('delete_murid', f'Padam murid: {nama}')
@@ -573,6 +2864,7 @@ def pindah_murid(murid_id):
     if action == 'pindah_sekolah':
         nama = murid.nama_penuh
         murid.is_deleted = True
+        bump_data_version()
         db.session.commit()
         log_activity('pindah_sekolah', f'Murid pindah sekolah: {nama}')
         flash(f'Murid {nama} telah dipindahkan ke sekolah lain.', 'success')
@@ -580,7 +2872,11 @@ def pindah_murid(murid_id):
         new_kelas_id = request.form.get('new_kelas_id', type=int)
         if new_kelas_id:
             old_kelas = murid.kelas.nama_kelas
+            shift_rumusan_harian([murid.id], -1)
             murid.kelas_id = new_kelas_id
+            db.session.flush()
+            shift_rumusan_harian([murid.id], 1)
+            bump_data_version()
             db.session.commit()
             new_kelas = Kelas.query.get(new_kelas_id)
             log_activity('pindah_kelas', f'Murid {murid.nama_penuh} pindah dari {old_kelas} ke {new_kelas.nama_kelas}')
@@ -588,23 +2884,107 @@ def pindah_murid(murid_id):
 
     return redirect(request.referrer or url_for('dashboard_murid'))
 
+def is_dry_run():
+    return request.form.get('dry_run') in ('1', 'true')
+
+@app.route('/api/bulk-delete', methods=['POST'])
+@login_required
+@admin_required
+def api_bulk_delete():
+    ids = get_id_list('ids')
+    if not ids:
+        return jsonify({'success': False, 'error': 'Tiada murid dipilih'}), 400
+
+    if is_dry_run():
+        return jsonify({'success': True, 'dry_run': True, 'count': count_active_murid(Murid.id.in_(ids))})
+
+    count = bulk_soft_delete_murid(ids)
+    bump_data_version()
+    log_activity('bulk_delete_murid', f'Padam {count} murid serentak', commit=False)
+    db.session.commit()
+    return jsonify({'success': True, 'dry_run': False, 'count': count})
+
+@app.route('/api/bulk-move', methods=['POST'])
+@login_required
+@admin_required
+def api_bulk_move():
+    ids = get_id_list('ids')
+    kelas = next((k for k in get_kelas_list() if k.id == request.form.get('kelas_id', type=int)), None)
+    if not ids or kelas is None:
+        return jsonify({'success': False, 'error': 'Pilih murid dan kelas baru'}), 400
+
+    if is_dry_run():
+        count = count_active_murid(and_(Murid.id.in_(ids), Murid.kelas_id != kelas.id))
+        return jsonify({'success': True, 'dry_run': True, 'count': count, 'kelas': kelas.nama_kelas})
+
+    count = bulk_move_murid(ids, kelas.id)
+    bump_data_version()
+    log_activity('bulk_pindah_kelas', f'Pindah {count} murid ke {kelas.nama_kelas}', commit=False)
+    db.session.commit()
+    return jsonify({'success': True, 'dry_run': False, 'count': count, 'kelas': kelas.nama_kelas})
+
+@app.route('/api/promote-tingkatan', methods=['POST'])
+@login_required
+@admin_required
+def api_promote_tingkatan():
+    """Move a Tingkatan up a level, or every Tingkatan with tingkatan_id=semua.
+
+    Students of the last Tingkatan graduate (are soft-deleted) instead.
+    """
+    all_ids = [t.id for t in get_tingkatan_list()]
+    if request.form.get('tingkatan_id') == 'semua':
+        tingkatan_ids = set(all_ids)
+    else:
+        tingkatan_ids = {request.form.get('tingkatan_id', type=int)} & set(all_ids)
+    if not tingkatan_ids:
+        return jsonify({'success': False, 'error': 'Tingkatan tidak sah'}), 400
+
+    moves, graduating, unmatched = plan_promotion(tingkatan_ids)
+    counts = get_kelas_counts(list(moves) + graduating + [k.id for k in unmatched])
+    # Students in a kelas with no namesake above would be left behind
+    stranded = [k.nama_kelas for k in unmatched if counts[k.id]['murid']]
+    summary = {
+        'naik': sum(counts[kelas_id]['murid'] for kelas_id in moves),
+        'tamat': sum(counts[kelas_id]['murid'] for kelas_id in graduating),
+        'tiada_kelas_sepadan': stranded
+    }
+
+    if is_dry_run():
+        return jsonify({'success': True, 'dry_run': True, **summary})
+    if stranded:
+        return jsonify({'success': False, 'error': 'Tambah kelas sepadan di tingkatan seterusnya dahulu: '
+                        + ', '.join(stranded), **summary}), 400
+
+    promoted, graduated = promote_murid(moves, graduating)
+    bump_data_version()
+    log_activity('naik_tingkatan', f'Naik tingkatan: {promoted} murid naik, {graduated} murid tamat', commit=False)
+    db.session.commit()
+    return jsonify({'success': True, 'dry_run': False, 'naik': promoted, 'tamat': graduated,
+                    'tiada_kelas_sepadan': []})
+
 @app.route('/dashboard/profile', methods=['GET', 'POST'])
 @login_required
 def dashboard_profile():
     if request.method == 'POST':
         action = request.form.get('action')
 
+        # current_user is a cached, detached copy; change the row itself
+        user = db.session.get(User, current_user.id)
+
         if action == 'update_profile':
-            current_user.nama_guru = request.form.get('nama_guru', '').strip()
+            user.nama_guru = request.form.get('nama_guru', '').strip()
             bertugas_dari = request.form.get('bertugas_dari')
             bertugas_hingga = request.form.get('bertugas_hingga')
 
             if bertugas_dari:
-                current_user.bertugas_dari = datetime.strptime(bertugas_dari, '%Y-%m-%d').date()
+                user.bertugas_dari = datetime.strptime(bertugas_dari, '%Y-%m-%d').date()
             if bertugas_hingga:
-                current_user.bertugas_hingga = datetime.strptime(bertugas_hingga, '%Y-%m-%d').date()
+                user.bertugas_hingga = datetime.strptime(bertugas_hingga, '%Y-%m-%d').date()
 
+            bump_data_version()
+            bump_data_version(REFERENCE_VERSION_ID)
             db.session.commit()
+            reference_cache.invalidate()
             log_activity('update_profile', 'Kemaskini profil')
             flash('Profil berjaya dikemaskini.', 'success')
 
@@ -613,15 +2993,17 @@ def dashboard_profile():
             new_password = request.form.get('new_password')
             confirm_password = request.form.get('confirm_password')
 
-            if not current_user.check_password(current_password):
+            if not user.check_password(current_password):
                 flash('Kata laluan semasa tidak betul.', 'danger')
             elif new_password != confirm_password:
                 flash('Kata laluan baru tidak sepadan.', 'danger')
             elif len(new_password) < 6:
                 flash('Kata laluan baru mesti sekurang-kurangnya 6 aksara.', 'danger')
             else:
-                current_user.set_password(new_password)
+                user.set_password(new_password)
+                bump_data_version(REFERENCE_VERSION_ID)
                 db.session.commit()
+                reference_cache.invalidate()
                 log_activity('change_password', 'Tukar kata laluan')
                 flash('Kata laluan berjaya ditukar.', 'success')
 
@@ -629,6 +3011,30 @@ def dashboard_profile():
 
     return render_template('dashboard_profile.html')
 
+@app.route('/dashboard/kategori', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def dashboard_kategori():
+    if request.method == 'POST':
+        for category in CategoryAlasan.query.all():
+            keywords = request.form.get(f'keywords_{category.id}')
+            if keywords is None:
+                continue
+            cleaned = ','.join(dict.fromkeys(k.strip().lower() for k in keywords.split(',') if k.strip()))
+            category.keywords = cleaned
+
+        bump_data_version()
+        bump_data_version(REFERENCE_VERSION_ID)
+        db.session.commit()
+        reference_cache.invalidate()
+
+        log_activity('edit_kategori', 'Kemaskini kata kunci kategori alasan')
+        flash('Kata kunci kategori berjaya dikemaskini. Jalankan "flask reclassify" untuk mengemas kini rekod lama.', 'success')
+        return redirect(url_for('dashboard_kategori'))
+
+    categories = CategoryAlasan.query.order_by(CategoryAlasan.id).all()
+    return render_template('dashboard_kategori.html', categories=categories)
+
 @app.route('/api/search-murid')
 @login_required
 def api_search_murid():
@@ -637,116 +3043,34 @@ def api_search_murid():
     if len(query) < 2:
         return jsonify([])
 
-    murid_list = Murid.query.join(Kelas).filter(
-        Murid.is_deleted == False,
-        or_(
-            func.lower(Murid.nama_penuh).contains(query.lower()),
-            func.lower(Murid.ic).contains(query.lower())
-        )
-    ).limit(10).all()
-
     result = []
-    for murid in murid_list:
+    for murid in search_murid(query):
         result.append({
             'id': murid.id,
             'nama_penuh': murid.nama_penuh,
             'ic': murid.ic,
-            'kelas': murid.kelas.nama_kelas,
+            'kelas': murid.nama_kelas,
             'jantina': murid.jantina
         })
 
-    return jsonify(result)
+    response = jsonify(result)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['SEARCH_CACHE_MAX_AGE']
+    return response
 
 @app.route('/generate-surat/<int:murid_id>')
 @login_required
 def generate_surat(murid_id):
-    murid = Murid.query.get_or_404(murid_id)
     month = request.args.get('month', date.today().month, type=int)
     year = request.args.get('year', date.today().year, type=int)
-    preview = request.args.get('preview', False)
-
-    kehadiran = KehadiranLewat.query.filter(
-        KehadiranLewat.murid_id == murid_id,
-        extract('month', KehadiranLewat.tarikh) == month,
-        extract('year', KehadiranLewat.tarikh) == year
-    ).order_by(KehadiranLewat.tarikh).all()
-
-    doc = Document()
-
-    style = doc.styles['Normal']
-    style.font.name = 'Times New Roman'
-    style.font.size = Pt(12)
-
-    header = doc.add_paragraph()
-    header.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-    header.add_run(f"Tarikh: {date.today().strftime('%d/%m/%Y')}")
-
-    doc.add_paragraph()
-
-    title = doc.add_paragraph()
-    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    title_run = title.add_run("Perkara: Surat Amaran – Kehadiran Lewat Melebihi 3 Kali")
-    title_run.bold = True
-
-    doc.add_paragraph()
-
-    doc.add_paragraph("Kepada:")
-    doc.add_paragraph(f"Nama Penuh Murid: {murid.nama_penuh}")
-    doc.add_paragraph(f"Kelas: {murid.kelas.nama_kelas}")
-
-    doc.add_paragraph()
-
-    doc.add_paragraph("Assalamualaikum dan Salam sejahtera")
-
-    doc.add_paragraph()
-
-    bulan_names = ['', 'Januari', 'Februari', 'Mac', 'April', 'Mei', 'Jun', 
-                   'Julai', 'Ogos', 'September', 'Oktober', 'November', 'Disember']
-    bulan_name = bulan_names[month]
-
-    content = doc.add_paragraph()
-    content.add_run(
-        f"Dengan segala hormatnya, saya selaku guru bertugas mingguan ingin memaklumkan bahawa "
-        f"murid yang dinyatakan di atas telah hadir lewat ke sekolah melebihi tiga (3) kali "
-        f"bagi bulan {bulan_name} {year}. Butiran kelewatan adalah seperti berikut:"
-    )
-
-    doc.add_paragraph()
-
-    hari_names = ['Isnin', 'Selasa', 'Rabu', 'Khamis', 'Jumaat', 'Sabtu', 'Ahad']
-
-    for k in kehadiran:
-        hari = hari_names[k.tarikh.weekday()]
-        tarikh = k.tarikh.strftime('%d/%m/%Y')
-        masa = k.masa_sampai.strftime('%H:%M')
-        doc.add_paragraph(f"• {hari}, {tarikh}, {masa}")
-
-    doc.add_paragraph()
-
-    doc.add_paragraph(
-        "Kelewatan berulang ini adalah dikesan melalui guru bertugas mingguan dan dicatat "
-        "sebagai tindakan disiplin yang perlu diberi perhatian. Murid diminta untuk mengambil "
-        "perhatian serius terhadap perkara ini dan memastikan menghadirkan diri tepat pada "
-        "waktunya pada masa hadapan bagi mengelakkan tindakan disiplin seterusnya."
-    )
+    if not is_valid_month(month, year):
+        abort(400)
 
-    doc.add_paragraph()
-
-    doc.add_paragraph("Sekian, terima kasih atas kerjasama pihak murid dan ibubapa/penjaga.")
-
-    doc.add_paragraph()
-    doc.add_paragraph()
-
-    signature = doc.add_paragraph()
-    signature.add_run("Yang benar,")
-    doc.add_paragraph()
-    doc.add_paragraph()
-
-    guru_name = current_user.nama_guru or current_user.username
-    guru_para = doc.add_paragraph()
-    guru_run = guru_para.add_run(f"({guru_name})")
-    guru_run.bold = True
-    doc.add_paragraph("Guru Bertugas Mingguan")
+    surat_list = get_surat_data([murid_id], month, year)
+    if not surat_list:
+        abort(404)
+    surat = surat_list[0]
+    surat_file, = get_surat_files(surat_list, month, year)
 
     surat_record = SuratAmaran(
         murid_id=murid_id,
@@ -755,21 +3079,75 @@ def generate_surat(murid_id):
         printed_by=current_user.id
     )
     db.session.add(surat_record)
+    bump_data_version(history=False)
     db.session.commit()
 
-    log_activity('print_surat', f'Print surat amaran untuk {murid.nama_penuh}')
+    log_activity('print_surat', f'Print surat amaran untuk {surat["nama_penuh"]}')
+
+    return send_file(
+        surat_file,
+        as_attachment=True,
+        download_name=surat_filename(surat),
+        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    )
+
+@app.route('/generate-surat/batch', methods=['POST'])
+@login_required
+def generate_surat_batch():
+    month = request.form.get('month', date.today().month, type=int)
+    year = request.form.get('year', date.today().year, type=int)
+    if not is_valid_month(month, year):
+        abort(400)
+    output = request.form.get('format', 'zip')
+
+    if request.form.get('semua'):
+        murid_ids = get_warning_murid_ids(month, year)
+    else:
+        murid_ids = get_id_list('murid_ids')
+
+    surat_list = get_surat_data(murid_ids, month, year) if murid_ids else []
+    if not surat_list:
+        flash('Tiada murid dipilih untuk surat amaran.', 'warning')
+        return redirect(url_for('dashboard_amaran', month=month, year=year))
 
-    file_stream = io.BytesIO()
-    doc.save(file_stream)
-    file_stream.seek(0)
+    if output == 'docx':
+        file_stream = get_surat_merged_file(surat_list, month, year)
+        download_name = f"Surat_Amaran_{month}_{year}.docx"
+        mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+    else:
+        file_stream = io.BytesIO()
+        used_names = set()
+        # .docx files are already deflated, so store them as-is
+        with zipfile.ZipFile(file_stream, 'w', zipfile.ZIP_STORED) as archive:
+            for item, surat_file in zip(surat_list, get_surat_files(surat_list, month, year)):
+                filename = surat_filename(item)
+                if filename in used_names:
+                    filename = filename.replace('.docx', f"_{item['murid_id']}.docx")
+                used_names.add(filename)
+                if isinstance(surat_file, str):
+                    archive.write(surat_file, filename)
+                else:
+                    archive.writestr(filename, surat_file.getvalue())
+        file_stream.seek(0)
+        download_name = f"Surat_Amaran_{month}_{year}.zip"
+        mimetype = 'application/zip'
+
+    db.session.execute(insert(SuratAmaran), [{
+        'murid_id': item['murid_id'],
+        'bulan': month,
+        'tahun': year,
+        'printed_by': current_user.id
+    } for item in surat_list])
+    bump_data_version(history=False)
+    db.session.commit()
 
-    filename = f"Surat_Amaran_{murid.nama_penuh.replace(' ', '_')}_{month}_{year}.docx"
+    log_activity('print_surat', f'Print {len(surat_list)} surat amaran untuk {month}/{year}')
 
     return send_file(
         file_stream,
         as_attachment=True,
-        download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+        download_name=download_name,
+        mimetype=mimetype
     )
 
 @app.route('/dashboard/denda/<int:murid_id>', methods=['POST'])
@@ -792,6 +3170,7 @@ def add_denda(murid_id):
         assigned_by=current_user.id
     )
     db.session.add(denda)
+    bump_data_version(history=False)
     db.session.commit()
 
     log_activity('add_denda', f'Tambah denda untuk {murid.nama_penuh}: {jenis_denda}')
@@ -799,172 +3178,229 @@ def add_denda(murid_id):
 
     return redirect(request.referrer or url_for('dashboard_amaran'))
 
-@app.route('/export/csv')
+@app.route('/dashboard/denda/batch', methods=['POST'])
 @login_required
-def export_csv():
-    filter_type = request.args.get('filter', 'weekly')
-    filter_month = request.args.get('month', type=int)
-    filter_year = request.args.get('year', type=int)
-    filter_date = request.args.get('date')
-    filter_kelas = request.args.get('kelas', '').strip()
-    filter_jantina = request.args.get('jantina', '').strip()
-    filter_nama = request.args.get('nama', '').strip()
-
-    today = date.today()
-    query = KehadiranLewat.query.options(
-        joinedload(KehadiranLewat.murid).joinedload(Murid.kelas),
-        joinedload(KehadiranLewat.category)
-    )
+def add_denda_batch():
+    month = request.form.get('month', date.today().month, type=int)
+    year = request.form.get('year', date.today().year, type=int)
+    if not is_valid_month(month, year):
+        abort(400)
+    jenis_denda = request.form.get('jenis_denda', '').strip()
+    nota = request.form.get('nota', '').strip()
 
-    if filter_type == 'weekly':
-        start_of_week = today - timedelta(days=today.weekday())
-        query = query.filter(KehadiranLewat.tarikh >= start_of_week)
-        title = f"Mingguan_{start_of_week.strftime('%d%m%Y')}_{today.strftime('%d%m%Y')}"
-    elif filter_type == 'monthly' and filter_month and filter_year:
-        query = query.filter(
-            extract('month', KehadiranLewat.tarikh) == filter_month,
-            extract('year', KehadiranLewat.tarikh) == filter_year
-        )
-        title = f"Bulanan_{filter_month}_{filter_year}"
-    elif filter_type == 'date' and filter_date:
-        try:
-            specific_date = datetime.strptime(filter_date, '%Y-%m-%d').date()
-            query = query.filter(KehadiranLewat.tarikh == specific_date)
-            title = f"Tarikh_{filter_date}"
-        except:
-            title = "Semua_Rekod"
+    if request.form.get('semua'):
+        murid_ids = get_warning_murid_ids(month, year)
     else:
-        title = "Semua_Rekod"
-
-    if filter_kelas:
-        query = query.join(Murid).join(Kelas).filter(Kelas.nama_kelas == filter_kelas)
-
-    if filter_jantina:
-        if not filter_kelas:
-            query = query.join(Murid)
-        query = query.filter(Murid.jantina == filter_jantina)
-
-    if filter_nama:
-        if not filter_kelas and not filter_jantina:
-            query = query.join(Murid)
-        query = query.filter(func.lower(Murid.nama_penuh).contains(filter_nama.lower()))
-
-    records = query.order_by(KehadiranLewat.tarikh.desc()).all()
-
-    data = []
-    for r in records:
-        data.append({
-            'Tarikh': r.tarikh.strftime('%d/%m/%Y'),
-            'Masa Sampai': r.masa_sampai.strftime('%H:%M'),
-            'Minit Lewat': r.minit_lewat or 0,
-            'Nama Murid': r.murid.nama_penuh,
-            'IC': r.murid.ic,
-            'Kelas': r.murid.kelas.nama_kelas,
-            'Jantina': r.murid.jantina,
-            'Kategori Alasan': r.category.nama if r.category else '',
-            'Alasan': r.alasan or '',
-            'Nota': r.nota or ''
-        })
+        murid_ids = get_id_list('murid_ids')
 
-    df = pd.DataFrame(data)
+    if not jenis_denda or not murid_ids:
+        flash('Sila pilih murid dan masukkan jenis denda.', 'danger')
+        return redirect(url_for('dashboard_amaran', month=month, year=year))
 
-    total = len(data)
-    lelaki = sum(1 for d in data if d['Jantina'] == 'Lelaki')
-    perempuan = sum(1 for d in data if d['Jantina'] == 'Perempuan')
+    count = assign_denda_batch(murid_ids, jenis_denda, nota)
+    bump_data_version(history=False)
+    log_activity('add_denda', f'Tambah denda untuk {count} murid: {jenis_denda}', commit=False)
+    db.session.commit()
 
-    csv_output = io.StringIO()
-    df.to_csv(csv_output, index=False, encoding='utf-8')
-    csv_output.seek(0)
+    flash(f'Denda berjaya ditambah untuk {count} murid.', 'success')
+    return redirect(url_for('dashboard_amaran', month=month, year=year))
 
-    return Response(
-        csv_output.getvalue(),
-        mimetype='text/csv; charset=utf-8',
-        headers={'Content-Disposition': f'attachment; filename="Laporan_Kehadiran_Lewat_{title}.csv"'}
-    )
-
-@app.route('/export/pdf')
+@app.route('/dashboard/denda')
 @login_required
-def export_pdf():
-    filter_type = request.args.get('filter', 'monthly')
-    filter_month = request.args.get('month', date.today().month, type=int)
-    filter_year = request.args.get('year', date.today().year, type=int)
-
-    query = KehadiranLewat.query.options(
-        joinedload(KehadiranLewat.murid).joinedload(Murid.kelas),
-        joinedload(KehadiranLewat.category)
-    ).filter(
-        extract('month', KehadiranLewat.tarikh) == filter_month,
-        extract('year', KehadiranLewat.tarikh) == filter_year
-    )
-
-    records = query.order_by(KehadiranLewat.tarikh).all()
-
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    p.setFont("Helvetica-Bold", 16)
-    p.drawCentredString(width/2, height - 50, "Laporan Kehadiran Lewat")
+@conditional_get
+def dashboard_denda():
+    filters = get_denda_filters()
+    after = decode_denda_cursor(request.args.get('after'))
+    records, next_cursor = get_denda_page(filters, after, get_page_size())
 
-    bulan_names = ['', 'Januari', 'Februari', 'Mac', 'April', 'Mei', 'Jun', 
-                   'Julai', 'Ogos', 'September', 'Oktober', 'November', 'Disember']
-    p.setFont("Helvetica", 12)
-    p.drawCentredString(width/2, height - 70, f"Bulan: {bulan_names[filter_month]} {filter_year}")
-
-    total = len(records)
-    lelaki = sum(1 for r in records if r.murid.jantina == 'Lelaki')
-    perempuan = sum(1 for r in records if r.murid.jantina == 'Perempuan')
-
-    y = height - 110
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, y, f"Jumlah Keseluruhan: {total}")
-    p.drawString(250, y, f"Lelaki: {lelaki}")
-    p.drawString(350, y, f"Perempuan: {perempuan}")
+    return render_template('dashboard_denda.html',
+                         records=records,
+                         next_cursor=next_cursor,
+                         status_counts=count_denda_by_status(filters),
+                         users=get_users(),
+                         kelas_list=get_kelas_list(),
+                         filters=filters)
 
-    y -= 40
-    p.setFont("Helvetica-Bold", 10)
-    headers = ['Tarikh', 'Masa', 'Nama', 'Kelas', 'Jantina']
-    x_positions = [50, 120, 180, 380, 480]
+@app.route('/dashboard/denda/selesai', methods=['POST'])
+@login_required
+def complete_denda():
+    denda_ids = get_id_list('denda_ids')
+    if not denda_ids:
+        flash('Tiada denda dipilih.', 'warning')
+        return redirect(request.referrer or url_for('dashboard_denda'))
+
+    count = complete_denda_batch(denda_ids)
+    bump_data_version(history=False)
+    log_activity('complete_denda', f'Tanda {count} denda selesai', commit=False)
+    db.session.commit()
 
-    for i, header in enumerate(headers):
-        p.drawString(x_positions[i], y, header)
+    flash(f'{count} denda ditanda selesai.', 'success')
+    return redirect(request.referrer or url_for('dashboard_denda'))
 
-    y -= 20
-    p.setFont("Helvetica", 9)
+@app.route('/export/csv')
+@login_required
+@conditional_get
+def export_csv():
+    filters = get_history_filters()
+    filter_type = filters['filter_type']
 
-    for record in records:
-        if y < 50:
-            p.showPage()
-            y = height - 50
-            p.setFont("Helvetica", 9)
+    today = date.today()
+    # Plain column tuples, not ORM objects, so rows can be streamed without
+    # building an identity map of the whole export.
+    query = db.session.query(
+        KehadiranLewat.tarikh,
+        KehadiranLewat.masa_sampai,
+        KehadiranLewat.minit_lewat,
+        Murid.nama_penuh,
+        Murid.ic,
+        Kelas.nama_kelas,
+        Murid.jantina,
+        CategoryAlasan.nama,
+        KehadiranLewat.alasan,
+        KehadiranLewat.nota
+    ).join(Murid, Murid.id == KehadiranLewat.murid_id).join(
+        Kelas, Kelas.id == Murid.kelas_id
+    ).outerjoin(CategoryAlasan, CategoryAlasan.id == KehadiranLewat.category_id)
 
-        p.drawString(50, y, record.tarikh.strftime('%d/%m/%Y'))
-        p.drawString(120, y, record.masa_sampai.strftime('%H:%M'))
+    period = get_period_range(filter_type, filters['month'], filters['year'], filters['date'])
+    query = apply_history_filters(query, filters, period)
 
-        nama = record.murid.nama_penuh[:30]
-        p.drawString(180, y, nama)
-        p.drawString(380, y, record.murid.kelas.nama_kelas)
-        p.drawString(480, y, record.murid.jantina)
+    if filter_type == 'weekly':
+        title = f"Mingguan_{period[0].strftime('%d%m%Y')}_{today.strftime('%d%m%Y')}"
+    elif filter_type == 'monthly':
+        title = f"Bulanan_{period[0].month}_{period[0].year}"
+    elif filter_type == 'academic':
+        title = f"Sesi_{academic_year_label(period[0].year).replace('/', '_')}"
+    elif period:
+        title = f"Tarikh_{filters['date']}"
+    else:
+        title = "Semua_Rekod"
 
-        y -= 15
+    query = query.order_by(KehadiranLewat.tarikh.desc(), KehadiranLewat.id.desc())
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(['Tarikh', 'Masa Sampai', 'Minit Lewat', 'Nama Murid', 'IC', 'Kelas',
+                         'Jantina', 'Kategori Alasan', 'Alasan', 'Nota'])
+        yield buffer.getvalue()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+        for r in query.yield_per(CSV_CHUNK_SIZE):
+            writer.writerow([
+                r.tarikh.strftime('%d/%m/%Y'),
+                r.masa_sampai.strftime('%H:%M'),
+                r.minit_lewat or 0,
+                r.nama_penuh,
+                r.ic,
+                r.nama_kelas,
+                r.jantina,
+                r.nama or '',
+                r.alasan or '',
+                r.nota or ''
+            ])
+            if buffer.tell() >= CSV_FLUSH_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
 
-    p.save()
-    buffer.seek(0)
+    return Response(
+        stream_with_slot(generate()),
+        content_type='text/csv; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename="Laporan_Kehadiran_Lewat_{title}.csv"'}
+    )
 
-    filename = f"Laporan_Kehadiran_Lewat_{filter_month}_{filter_year}.pdf"
+@app.route('/export/pdf')
+@login_required
+@conditional_get
+def export_pdf():
+    """Monthly report, or filter=academic for the whole academic year.
 
+    group=kelas splits the report into kelas sections with subtotals; it is
+    the default for the yearly report.
+    """
+    filter_type = 'academic' if request.args.get('filter') == 'academic' else 'monthly'
+    filter_month = request.args.get('month', date.today().month, type=int)
+    filter_year = request.args.get('year', type=int)
+    if filter_year is None:
+        filter_year = current_academic_year() if filter_type == 'academic' else date.today().year
+    if not is_valid_month(filter_month, filter_year):
+        abort(400)
+    group = request.args.get('group', 'kelas' if filter_type == 'academic' else 'tarikh')
+    if group not in LAPORAN_GROUPS:
+        abort(400)
+
+    _, _, _, label = get_laporan_period(filter_type, filter_month, filter_year)
     return send_file(
-        buffer,
+        get_laporan_pdf(filter_type, filter_month, filter_year, group),
         as_attachment=True,
-        download_name=filename,
+        download_name=laporan_filename(label),
         mimetype='application/pdf'
     )
 
 @app.route('/api/stats')
+@conditional_get
 def api_stats():
     stats = get_weekly_stats()
     return jsonify(stats)
 
+@app.route('/api/cache-stats')
+@login_required
+@admin_required
+def api_cache_stats():
+    return jsonify({'reference': reference_cache.stats(), 'artifacts': artifact_store.stats()})
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        if not current_user.is_authenticated or current_user.role != 'admin':
+            abort(403)
+
+    lines = route_metrics.render()
+    gauges = {
+        'activity_log': activity_log_writer.stats(),
+        'reference_cache': reference_cache.stats(),
+        'live': live_broadcaster.stats(),
+        'request_slots': request_slots.stats(),
+    }
+    for group, values in gauges.items():
+        for name, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'# TYPE kehadiran_{group}_{name} gauge')
+                lines.append(f'kehadiran_{group}_{name} {value:g}')
+
+    return Response('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/stream')
+def api_stream():
+    private = current_user.is_authenticated
+    subscriber = live_broadcaster.subscribe(private=private)
+    if subscriber is None:
+        # EventSource does not reconnect after a 204; the page polls instead
+        return Response(status=204)
+
+    # Start every connection with a snapshot so a reconnect never misses
+    # a check-in made while it was away
+    try:
+        initial = [f'event: stats\ndata: {json.dumps(get_weekly_stats())}\n\n']
+        if private:
+            recent = [serialize_recent_checkin(r) for r in get_recent_checkins()]
+            initial.append(f'event: recent\ndata: {json.dumps(recent)}\n\n')
+    except Exception:
+        live_broadcaster.unsubscribe(subscriber)
+        raise
+    db.session.remove()
+
+    response = Response(live_stream(subscriber, initial), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.errorhandler(404)
 def not_found(e):
     return render_template('error.html', error='Halaman tidak dijumpai'), 404
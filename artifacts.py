@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import tempfile
+import time
+
+# Rendered reports and letters, stored under the SHA-256 of everything that
+# went into them. The same inputs always map to the same file, so a closed
+# month is rendered once, and a changed record simply produces a new key.
+# Superseded files are never read again; prune() removes the least recently
+# used ones by age and total size. Like surat.py this module is kept free
+# of Flask and database imports.
+
+class ArtifactStore:
+    def __init__(self, root):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+    def key(self, kind, inputs):
+        payload = json.dumps([kind, inputs], sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.root, key[:2], key + ext)
+
+    def get(self, key, ext):
+        path = self.path(key, ext)
+        try:
+            # The modification time doubles as last use for prune()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, ext, content):
+        return self.write(key, ext, lambda f: f.write(content))
+
+    def write(self, key, ext, render_to):
+        """Store what render_to(file) writes under key; readers never see a partial file."""
+        path = self.path(key, ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                render_to(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return path
+
+    def get_or_render(self, kind, ext, inputs, render):
+        """Return the path of the artifact for inputs, calling render(inputs) only on a miss."""
+        return self.get_or_write(self.key(kind, inputs), ext, lambda f: f.write(render(inputs)))
+
+    def get_or_write(self, key, ext, render_to):
+        """Return the path stored under key, calling render_to(file) only on a miss."""
+        path = self.get(key, ext)
+        if path:
+            self.hits += 1
+            return path
+        self.misses += 1
+        return self.write(key, ext, render_to)
+
+    def get_or_render_many(self, kind, ext, inputs_list, render_many):
+        """get_or_render for a list; render_many is called once with just the missing inputs."""
+        keys = [self.key(kind, inputs) for inputs in inputs_list]
+        paths = [self.get(key, ext) for key in keys]
+        missing = [i for i, path in enumerate(paths) if path is None]
+        self.hits += len(paths) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            rendered = render_many([inputs_list[i] for i in missing])
+            for i, content in zip(missing, rendered):
+                paths[i] = self.put(keys[i], ext, content)
+        return paths
+
+    def prune(self, max_bytes=None, max_age=None):
+        """Delete files unused for max_age seconds, then the least recently used
+        until the store fits in max_bytes. Returns (files removed, bytes freed).
+
+        A file being sent while it is removed stays readable on POSIX; the
+        next request for it simply renders it again.
+        """
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        cutoff = time.time() - max_age if max_age is not None else None
+        removed = freed = 0
+        for mtime, size, path in files:
+            too_old = cutoff is not None and mtime < cutoff
+            too_big = max_bytes is not None and total > max_bytes
+            if not (too_old or too_big):
+                break
+            if path.endswith('.tmp') and not too_old:
+                # Still being written
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        self.pruned += removed
+        return removed, freed
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'pruned': self.pruned}
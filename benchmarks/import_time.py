@@ -0,0 +1,75 @@
+"""Measure how long `import app` takes in a fresh interpreter.
+
+Each run starts a new Python process against a scratch SQLite database,
+so module loading and anything done at import time are both counted.
+Pass --compare REV to measure an older commit the same way, e.g. the
+commit before lazy imports:
+
+    python benchmarks/import_time.py --compare HEAD~1
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['pandas', 'numpy', 'docx', 'reportlab']
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def measure(source_dir, runs):
+    timings = []
+    loaded = []
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(scratch, 'bench.db'))
+        for _ in range(runs):
+            output = subprocess.run(
+                [sys.executable, '-c', PROBE], cwd=source_dir, env=env,
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            timings.append(result['seconds'])
+            loaded = result['loaded']
+    return timings, loaded
+
+
+def export_revision(rev, target):
+    archive = subprocess.run(['git', 'archive', rev], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', target], input=archive, check=True)
+
+
+def report(label, timings, loaded):
+    print(f'{label:<10} median {statistics.median(timings) * 1000:7.0f} ms   '
+          f'min {min(timings) * 1000:7.0f} ms   heavy modules loaded: {", ".join(loaded) or "none"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--compare', metavar='REV', help='git revision to measure alongside the working tree')
+    args = parser.parse_args()
+
+    if args.compare:
+        target = tempfile.mkdtemp()
+        try:
+            export_revision(args.compare, target)
+            report(args.compare, *measure(target, args.runs))
+        finally:
+            shutil.rmtree(target)
+
+    report('current', *measure(ROOT, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Compare database queries per minute for polling /api/stats against the SSE stream.
+
+Simulates one minute with N screens open and a number of check-ins spread
+across it. Polling mode replays what index.html used to do: every screen
+fetches /api/stats every 30 seconds. Stream mode subscribes every screen
+to a LiveBroadcaster and counts what its poll() runs: once every
+LIVE_POLL_INTERVAL seconds, plus straight after each check-in, as the
+committing process wakes it. Figures are for one server process; every
+process with screens connected polls on its own. Only the queries spent on
+delivering stats are counted; the check-ins themselves cost the same in
+both modes.
+
+Run from the project root against a scratch database:
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/live_stats.py --screens 50
+"""
+import os
+import sys
+import argparse
+import tempfile
+import time as _time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'))
+os.environ.setdefault('ACTIVITY_LOG_SYNC', '1')
+
+from sqlalchemy import event
+
+import app as appmod
+from models import db, Kelas
+
+POLL_INTERVAL = 30
+MINUTE = 60
+
+
+class SimulatedClock:
+    """Stands in for the time module so cache TTLs follow simulated time."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        # Request timing keeps real time
+        return _time.perf_counter()
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        self.active = False
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        if self.active:
+            self.count += 1
+
+    def measure(self, fn, *args, **kwargs):
+        self.active = True
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.active = False
+
+
+def checkin_times(checkins):
+    return [MINUTE * (i + 0.5) / checkins for i in range(checkins)]
+
+
+def run(mode, screens, checkins):
+    app = appmod.app
+    clock = SimulatedClock()
+    appmod.time = clock
+
+    with app.app_context():
+        appmod.init_database()
+        if not Kelas.query.first():
+            db.session.add(Kelas(nama_kelas='1 Bench', tingkatan_id=1))
+            db.session.commit()
+        kelas_id = Kelas.query.first().id
+        counter = QueryCounter(db.engine)
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'skuses7620'})
+
+    events = [(t, 'checkin', i) for i, t in enumerate(checkin_times(checkins))]
+    subscribers = []
+    broadcaster = None
+    if mode == 'poll':
+        # Screens open at staggered moments, as they would in a school
+        for screen in range(screens):
+            offset = POLL_INTERVAL * screen / screens
+            t = offset
+            while t < MINUTE:
+                events.append((t, 'poll', screen))
+                t += POLL_INTERVAL
+    else:
+        interval = app.config['LIVE_POLL_INTERVAL']
+        broadcaster = appmod.LiveBroadcaster(lambda: screens, lambda: interval, background=False)
+        subscribers = [broadcaster.subscribe(private=screen % 2 == 0) for screen in range(screens)]
+        t = interval
+        while t < MINUTE:
+            events.append((t, 'tick', 0))
+            t += interval
+        # Screens opened with a snapshot; only what follows is counted
+        with app.app_context():
+            broadcaster.poll()
+        for subscriber in subscribers:
+            while not subscriber.empty():
+                subscriber.get_nowait()
+
+    appmod.weekly_stats_cache.invalidate()
+    delivered = 0
+    requests = 0
+    for t, kind, index in sorted(events, key=lambda e: (e[0], e[1])):
+        clock.now = t
+        if kind == 'checkin':
+            client.post('/dashboard/checkin', data={
+                'nama_penuh': f'Murid Bench {index}', 'ic': f'99{index:010d}',
+                'jantina': 'Lelaki' if index % 2 else 'Perempuan',
+                'kelas_id': str(kelas_id), 'alasan': 'hujan', 'minit_lewat': '5'
+            })
+        elif kind == 'poll':
+            counter.measure(client.get, '/api/stats')
+            delivered += 1
+            requests += 1
+
+        if broadcaster is not None:
+            with app.app_context():
+                counter.measure(broadcaster.poll)
+            for subscriber in subscribers:
+                while not subscriber.empty():
+                    subscriber.get_nowait()
+                    delivered += 1
+
+    return counter.count, requests, delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--screens', type=int, default=50)
+    parser.add_argument('--checkins', type=int, default=6, help='check-ins during the simulated minute')
+    args = parser.parse_args()
+
+    print(f'{args.screens} screens, {args.checkins} check-ins per minute')
+    print(f'{"mode":<8}{"queries/min":>14}{"requests/min":>15}{"messages/min":>15}')
+    for mode in ('poll', 'stream'):
+        queries, requests, delivered = run(mode, args.screens, args.checkins)
+        print(f'{mode:<8}{queries:>14}{requests:>15}{delivered:>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Check-in throughput of "flask serve" at different worker counts.
+
+For each worker count the script starts the production server on a
+scratch database seeded by benchmarks/synthetic.py. It then has a number
+of concurrent clients, each logged in with its own session, post
+check-ins for a fixed time, and reports requests/second and latency.
+
+    python benchmarks/load_test.py --workers 1,2,4 --clients 16 --duration 15
+
+Point DATABASE_URL at PostgreSQL to measure a real deployment. On SQLite
+every check-in takes the database write lock, so extra workers mostly
+queue on it.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import http.client
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client(threading.Thread):
+    def __init__(self, port, murid_ids, deadline):
+        super().__init__(daemon=True)
+        self.port = port
+        self.murid_ids = murid_ids
+        self.deadline = deadline
+        self.latencies = []
+        self.errors = 0
+
+    def post(self, connection, path, form, cookie=None):
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if cookie:
+            headers['Cookie'] = cookie
+        connection.request('POST', path, body=urlencode(form), headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response
+
+    def run(self):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        login = self.post(connection, '/login', {'username': 'guru', 'password': 'smkserikundang7620'})
+        cookie = '; '.join(c.split(';', 1)[0] for c in login.headers.get_all('Set-Cookie') or [])
+
+        while time.monotonic() < self.deadline:
+            form = {'murid_id': random.choice(self.murid_ids), 'alasan': 'hujan lebat',
+                    'minit_lewat': random.randint(1, 30)}
+            start = time.perf_counter()
+            try:
+                response = self.post(connection, '/dashboard/checkin', form, cookie)
+                ok = response.status == 302 and 'checkin' in response.getheader('Location', '')
+            except (OSError, http.client.HTTPException):
+                ok = False
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            if ok:
+                self.latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                self.errors += 1
+
+
+def prepare_database(env):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'init-db'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'synthetic.py'),
+                    '--students', '1000', '--years', '1'],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+    probe = 'import app; from models import db, Murid\n' \
+            'with app.app.app_context(): print(",".join(str(i) for (i,) in db.session.query(Murid.id)))'
+    output = subprocess.run([sys.executable, '-c', probe], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return [int(i) for i in output.strip().split(',')]
+
+
+def run_load(env, murid_ids, workers, threads, clients, duration):
+    port = free_port()
+    server_env = dict(env, WEB_WORKERS=str(workers), WEB_THREADS=str(threads))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'serve', '--host', '127.0.0.1', '--port', str(port)],
+        cwd=ROOT, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port)
+        deadline = time.monotonic() + duration
+        pool = [Client(port, murid_ids, deadline) for _ in range(clients)]
+        for client in pool:
+            client.start()
+        for client in pool:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies = sorted(l for client in pool for l in client.latencies)
+    errors = sum(client.errors for client in pool)
+    return {
+        'checkins': len(latencies),
+        'per_second': len(latencies) / duration,
+        'p50_ms': statistics.median(latencies) if latencies else 0,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15)
+    args = parser.parse_args()
+
+    env = dict(os.environ, ACTIVITY_LOG_SYNC='0')
+    if 'DATABASE_URL' not in env:
+        env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+    murid_ids = prepare_database(env)
+
+    print(f'{args.clients} clients, {args.threads} threads per worker, {args.duration:g}s each')
+    print(f'{"workers":>8}{"check-ins":>11}{"per sec":>10}{"p50 ms":>9}{"p95 ms":>9}{"errors":>8}')
+    for workers in (int(w) for w in args.workers.split(',')):
+        result = run_load(env, murid_ids, workers, args.threads, args.clients, args.duration)
+        print(f'{workers:>8}{result["checkins"]:>11}{result["per_second"]:>10.1f}'
+              f'{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}{result["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Throughput and memory of the PDF report engine.
+
+Renders a report of --rows late arrivals (50,000 by default, about a
+year of a large school) and reports pages/second and peak RSS. Every
+layout runs in a fresh process, so peak RSS reflects that run alone.
+Rows are either streamed from a generator, as export_pdf streams them
+from the database, or built into a list first, the way the old report
+loaded the month with .all().
+
+    python benchmarks/pdf_report.py --rows 50000
+
+With --database the rows are streamed from a synthetic SQLite database
+through the same query export_pdf uses; create one first with
+benchmarks/synthetic.py (--per-day 200 gives about 50,000 a year).
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from datetime import date, time as dtime, timedelta
+
+import resource
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# synthetic.py imports the app, which would count towards peak RSS here
+NAMA = ['Ahmad', 'Muhammad Haziq', 'Nur', 'Siti Nurul', 'Aisyah', 'Wei Jie', 'Kavitha', 'Danial']
+NAMA_BAPA = ['Abdullah', 'Ismail', 'Mohd Noor', 'Zainal Abidin', 'Rashid', 'Hamzah']
+KELAS_NAMES = ['Amanah', 'Bestari', 'Cerdik', 'Dedikasi', 'Efisien', 'Gemilang']
+
+
+def max_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def synthetic_rows(count, seed=1):
+    """Rows in kelas order, like laporan_query(group='kelas') returns them."""
+    rng = random.Random(seed)
+    sections = [(f'Tingkatan {t}', f'{t} {k}') for t in range(1, 6) for k in KELAS_NAMES]
+    per_section = count // len(sections) + 1
+    start = date.today() - timedelta(days=365)
+    produced = 0
+    for nama_tingkatan, nama_kelas in sections:
+        for n in range(per_section):
+            if produced == count:
+                return
+            lelaki = rng.random() < 0.5
+            nama = rng.choice(NAMA)
+            minit = rng.randrange(1, 60)
+            yield (
+                start + timedelta(days=n * 365 // per_section),
+                dtime(7, 30) if minit >= 30 else dtime(7, 30 + minit),
+                f"{nama} {'bin' if lelaki else 'binti'} {rng.choice(NAMA_BAPA)} {rng.choice(NAMA_BAPA)}",
+                nama_kelas,
+                'Lelaki' if lelaki else 'Perempuan',
+                nama_tingkatan
+            )
+            produced += 1
+
+
+def run_one(args):
+    from laporan import render_laporan_pdf
+
+    baseline = max_rss_mb()
+    started = time.perf_counter()
+
+    if args.database:
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+        import app as appmod
+        with appmod.app.app_context():
+            start, end = date.today() - timedelta(days=366), date.today() + timedelta(days=1)
+            query = appmod.laporan_query(start, end, args.group)
+            rows = appmod.iter_laporan_rows(query)
+            if args.materialise:
+                rows = list(rows)
+            totals = appmod.get_laporan_totals(start, end)
+            pages, count = render(render_laporan_pdf, rows, totals, args.group)
+    else:
+        rows = synthetic_rows(args.rows)
+        if args.materialise:
+            rows = list(rows)
+        totals = {'jumlah': args.rows, 'Lelaki': args.rows // 2, 'Perempuan': args.rows - args.rows // 2}
+        pages, count = render(render_laporan_pdf, rows, totals, args.group)
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'rows': count,
+        'pages': pages,
+        'seconds': round(elapsed, 2),
+        'pages_per_second': round(pages / elapsed, 1),
+        'rows_per_second': round(count / elapsed),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(max_rss_mb(), 1)
+    }))
+
+
+def render(render_laporan_pdf, rows, totals, group):
+    counted = [0]
+
+    def counting(rows):
+        for row in rows:
+            counted[0] += 1
+            yield row
+
+    with tempfile.TemporaryFile() as output:
+        pages = render_laporan_pdf(output, counting(rows), 'Laporan Kehadiran Lewat', 'Benchmark', totals, group)
+    return pages, counted[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--database', help='stream rows from this SQLite file instead')
+    parser.add_argument('--group', choices=['tarikh', 'kelas'], help='run one layout only')
+    parser.add_argument('--materialise', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(args)
+        return
+
+    source = args.database or f'{args.rows} synthetic rows'
+    print(f'Source: {source}')
+    print(f'{"layout":<10}{"rows":<8}{"loading":<10}{"pages":>7}{"seconds":>9}{"pages/s":>9}'
+          f'{"rows/s":>9}{"peak RSS":>10}{"growth":>9}')
+    for group in [args.group] if args.group else ['tarikh', 'kelas']:
+        for materialise in (False, True):
+            command = [sys.executable, __file__, '--single', '--rows', str(args.rows), '--group', group]
+            if args.database:
+                command += ['--database', args.database]
+            if materialise:
+                command.append('--materialise')
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f'{group:<10}{result["rows"]:<8}{"list" if materialise else "stream":<10}'
+                  f'{result["pages"]:>7}{result["seconds"]:>9.2f}{result["pages_per_second"]:>9.1f}'
+                  f'{result["rows_per_second"]:>9}{result["peak_rss_mb"]:>8.1f}MB'
+                  f'{result["peak_rss_mb"] - result["baseline_rss_mb"]:>7.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
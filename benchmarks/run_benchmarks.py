@@ -0,0 +1,252 @@
+"""End-to-end route benchmarks against a synthetic SQLite database.
+
+Builds (or reuses) a database from benchmarks/synthetic.py, then drives
+every main route through the Flask test client. For each scenario it
+records latency percentiles, SQL statements per request and peak Python
+memory, and writes them to a JSON file. Give --compare an earlier file to
+see what changed; the exit status is 1 when a p95 got slower by more than
+--tolerance and by at least --min-delta milliseconds, so timer noise on
+fast routes does not count.
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import date, datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def build_scenarios(murid_ids, search_terms):
+    today = date.today()
+    month, year = today.month, today.year
+
+    def checkin():
+        return 'POST', '/dashboard/checkin', {
+            'murid_id': str(random.choice(murid_ids)),
+            'alasan': random.choice(['hujan lebat', 'motor rosak', 'bangun lewat']),
+            'minit_lewat': str(random.randint(1, 40))
+        }
+
+    def get(path):
+        return lambda: ('GET', path, None)
+
+    return {
+        'checkin_post': (checkin, 1),
+        'checkin_form': (get('/dashboard/checkin'), 1),
+        'overview': (get('/dashboard'), 1),
+        'amaran': (get(f'/dashboard/amaran?month={month}&year={year}'), 1),
+        'history_weekly': (get('/dashboard/history?filter=weekly'), 1),
+        'history_monthly': (get('/dashboard/history?filter=monthly'), 1),
+        'history_academic': (get(f'/dashboard/history?filter=academic&year={year}'), 1),
+        'history_all': (get('/dashboard/history?filter=all'), 1),
+        'history_nama': (get('/dashboard/history?filter=all&nama=ali'), 1),
+        'api_history': (get('/api/history?filter=all&per_page=100'), 1),
+        'api_stats': (get('/api/stats'), 1),
+        'search': (lambda: ('GET', f'/api/search-murid?q={random.choice(search_terms)}', None), 1),
+        'murid_overview': (get('/dashboard/murid'), 1),
+        'denda_board': (get('/dashboard/denda'), 1),
+        'denda_board_kelas': (get('/dashboard/denda?status=semua&kelas_id=3'), 1),
+        'export_csv_monthly': (get('/export/csv?filter=monthly'), 1),
+        'export_csv_all': (get('/export/csv?filter=all'), 0.25),
+        'export_pdf_monthly': (get(f'/export/pdf?month={month}&year={year}'), 0.25),
+    }
+
+
+def request_once(client, make_request):
+    method, path, data = make_request()
+    if method == 'POST':
+        response = client.post(path, data=data)
+    else:
+        response = client.get(path)
+    # Drain streamed bodies so their queries and rendering are counted
+    body = response.get_data()
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method} {path} returned {response.status_code}')
+    return len(body)
+
+
+def run_scenario(client, counter, make_request, iterations, warmup):
+    for _ in range(warmup):
+        request_once(client, make_request)
+
+    latencies = []
+    queries = []
+    size = 0
+    for _ in range(iterations):
+        before = counter.count
+        start = time.perf_counter()
+        size = request_once(client, make_request)
+        latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count - before)
+
+    # Memory is measured on a separate pass: tracemalloc slows every allocation
+    gc.collect()
+    tracemalloc.start()
+    request_once(client, make_request)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'queries': statistics.median(queries),
+        'peak_kb': round(peak / 1024, 1),
+        'response_kb': round(size / 1024, 1)
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path, tolerance, min_delta):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    print(f'\n{"scenario":<22}{"p95 before":>12}{"p95 now":>10}{"change":>9}{"queries":>12}')
+    for name, result in current['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if not old:
+            print(f'{name:<22}{"-":>12}{result["p95_ms"]:>10.1f}{"new":>9}')
+            continue
+        change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        regressed = change > tolerance and result['p95_ms'] - old['p95_ms'] >= min_delta
+        flag = ' !' if regressed else ''
+        print(f'{name:<22}{old["p95_ms"]:>12.1f}{result["p95_ms"]:>10.1f}{change:>+9.0%}'
+              f'{old["queries"]:>6g} -> {result["queries"]:<4g}{flag}')
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='SQLite file to use; generated when missing or empty')
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--per-day', type=int, default=40)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 slowdown before a scenario counts as regressed')
+    parser.add_argument('--min-delta', type=float, default=5.0,
+                        help='ignore p95 slowdowns smaller than this many milliseconds')
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(database)
+
+    import app as appmod
+    import synthetic
+    from models import db, Murid
+
+    app = appmod.app
+    random.seed(1)
+
+    with app.app_context():
+        appmod.init_database()
+        if Murid.query.count() == 0:
+            started = time.perf_counter()
+            created = synthetic.generate(args.students, args.years, args.per_day)
+            print(f'Generated {created} in {time.perf_counter() - started:.1f}s')
+        murid_ids = [m.id for m in db.session.query(Murid.id).filter(Murid.is_deleted == False)]
+        search_terms = [n[:3].lower() for n in synthetic.NAMA_LELAKI + synthetic.NAMA_PEREMPUAN]
+        counter = QueryCounter(db.engine)
+        sizes = {table.name: db.session.execute(db.select(db.func.count()).select_from(table)).scalar()
+                 for table in db.metadata.sorted_tables}
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': 'skuses7620'})
+    if response.status_code != 302 or '/dashboard' not in response.headers.get('Location', ''):
+        sys.exit('Log masuk admin gagal; benchmark memerlukan akaun lalai.')
+
+    scenarios = build_scenarios(murid_ids, search_terms)
+    if args.only:
+        scenarios = {name: scenarios[name] for name in args.only.split(',')}
+
+    results = {}
+    print(f'{"scenario":<22}{"p50":>8}{"p95":>8}{"p99":>8}{"queries":>9}{"peak KB":>10}')
+    for name, (make_request, share) in scenarios.items():
+        iterations = max(3, int(args.iterations * share))
+        result = run_scenario(client, counter, make_request, iterations, args.warmup)
+        results[name] = result
+        print(f'{name:<22}{result["p50_ms"]:>8.1f}{result["p95_ms"]:>8.1f}{result["p99_ms"]:>8.1f}'
+              f'{result["queries"]:>9g}{result["peak_kb"]:>10.0f}')
+
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    if max_rss and sys.platform == 'darwin':
+        max_rss //= 1024
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': 'sqlite',
+            'rows': sizes,
+            'max_rss_kb': max_rss
+        },
+        'scenarios': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        regressions = compare(report, args.compare, args.tolerance, args.min_delta)
+        if regressions:
+            print(f'\nSlower than baseline: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
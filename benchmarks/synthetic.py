@@ -0,0 +1,188 @@
+"""Fill the database with a realistic, reproducible school.
+
+Creates kelas under every Tingkatan, students spread across them, a late
+arrival history covering every school day of the last few years (with a
+minority of habitually late students, as in real data), and the denda and
+surat amaran that history would have produced. The rollup tables are
+rebuilt at the end, so the result looks like a database that has been in
+use the whole time.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/synthetic.py --students 3000 --years 2
+"""
+import os
+import sys
+import random
+import argparse
+from datetime import date, time, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, func
+
+import app as appmod
+from models import db, User, Tingkatan, Kelas, Murid, KehadiranLewat, Denda, SuratAmaran
+
+KELAS_NAMES = ['Amanah', 'Bestari', 'Cerdik', 'Dedikasi', 'Efisien', 'Gemilang', 'Harmoni', 'Ikhlas']
+NAMA_LELAKI = ['Ahmad', 'Muhammad', 'Ali', 'Hafiz', 'Amir', 'Faris', 'Danial', 'Irfan', 'Haziq',
+               'Aiman', 'Syafiq', 'Luqman', 'Arif', 'Zulkifli', 'Rizal', 'Kumar', 'Wei Jie', 'Ravi']
+NAMA_PEREMPUAN = ['Nur', 'Siti', 'Aisyah', 'Nurul', 'Farah', 'Aina', 'Alya', 'Sofea', 'Hana',
+                  'Balqis', 'Damia', 'Iman', 'Qistina', 'Zara', 'Mei Ling', 'Priya', 'Kavitha']
+NAMA_BAPA = ['Abdullah', 'Ismail', 'Ibrahim', 'Hassan', 'Yusof', 'Rahman', 'Osman', 'Aziz',
+             'Hamzah', 'Salleh', 'Razak', 'Karim', 'Jamal', 'Rashid', 'Zainal', 'Mohd Noor']
+ALASAN = [
+    'Hujan lebat', 'hujan', 'banjir dekat rumah', 'jalan sesak', 'bas lambat', 'motor rosak',
+    'kereta rosak', 'tayar pancit', 'van lewat', 'ayah hantar lewat', 'adik sakit', 'mak sakit',
+    'urusan keluarga', 'bangun lewat', 'terlajak tidur', 'sakit perut', 'pergi klinik', '',
+]
+JENIS_DENDA = ['Kutip sampah', 'Bersihkan kelas', 'Menulis karangan', 'Siram pokok', 'Lari padang']
+
+CHUNK_SIZE = 5000
+
+
+def school_days(years):
+    today = date.today()
+    day = today - timedelta(days=365 * years)
+    while day <= today:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def bulk_insert(model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+def create_kelas(per_tingkatan):
+    existing = {k.nama_kelas for k in Kelas.query.all()}
+    rows = []
+    for tingkatan in Tingkatan.query.order_by(Tingkatan.id):
+        level = tingkatan.nama.split()[-1]
+        for nama in KELAS_NAMES[:per_tingkatan]:
+            nama_kelas = f'{level} {nama}'
+            if nama_kelas not in existing:
+                rows.append({'nama_kelas': nama_kelas, 'tingkatan_id': tingkatan.id,
+                             'nama_guru_kelas': f'Cikgu {random.choice(NAMA_BAPA)}'})
+    bulk_insert(Kelas, rows)
+    return [k.id for k in Kelas.query.order_by(Kelas.id)]
+
+
+def create_murid(count, kelas_ids):
+    start = (db.session.query(func.max(Murid.id)).scalar() or 0) + 1
+    rows = []
+    for n in range(start, start + count):
+        lelaki = random.random() < 0.5
+        nama = random.choice(NAMA_LELAKI if lelaki else NAMA_PEREMPUAN)
+        bapa = random.choice(NAMA_BAPA)
+        born = date(2008, 1, 1) + timedelta(days=random.randrange(5 * 365))
+        rows.append({
+            'nama_penuh': f"{nama} {'bin' if lelaki else 'binti'} {bapa}",
+            'ic': f"{born.strftime('%y%m%d')}{random.randrange(1, 15):02d}{n % 10000:04d}",
+            'jantina': 'Lelaki' if lelaki else 'Perempuan',
+            'no_ibu_bapa': f'01{random.randrange(10**7, 10**8)}',
+            'kelas_id': random.choice(kelas_ids),
+            'is_bookmarked': False,
+            'is_deleted': False
+        })
+    # The serial wraps at 10000, so drop the rare clashing IC
+    unique = {row['ic']: row for row in rows}
+    existing = {ic for (ic,) in db.session.query(Murid.ic)}
+    bulk_insert(Murid, [row for ic, row in unique.items() if ic not in existing])
+    return [m.id for m in db.session.query(Murid.id).filter(Murid.is_deleted == False)]
+
+
+def create_kehadiran(murid_ids, years, per_day, user_ids):
+    classifier = appmod.load_category_classifier()
+    # About one student in eight is habitually late and accounts for most records
+    weights = [8 if random.random() < 0.125 else 1 for _ in murid_ids]
+    monthly = {}
+    rows = []
+    total = 0
+    for day in school_days(years):
+        arrivals = max(0, int(random.gauss(per_day, per_day / 4)))
+        for murid_id in set(random.choices(murid_ids, weights=weights, k=arrivals)):
+            minit = int(random.expovariate(1 / 12)) + 1
+            masa = (7 * 60 + 30) + minit
+            alasan = random.choice(ALASAN)
+            rows.append({
+                'murid_id': murid_id,
+                'tarikh': day,
+                'masa_sampai': time(masa // 60 % 24, masa % 60),
+                'minit_lewat': minit,
+                'alasan': alasan,
+                'category_id': appmod.classify_alasan(alasan, classifier),
+                'nota': '',
+                'checked_by': random.choice(user_ids)
+            })
+            key = (murid_id, day.year, day.month)
+            monthly[key] = monthly.get(key, 0) + 1
+        if len(rows) >= CHUNK_SIZE:
+            bulk_insert(KehadiranLewat, rows)
+            total += len(rows)
+            rows = []
+    bulk_insert(KehadiranLewat, rows)
+    return total + len(rows), monthly
+
+
+def create_denda_and_surat(monthly, user_ids, denda_ratio, surat_ratio):
+    denda, surat = [], []
+    for (murid_id, tahun, bulan), count in monthly.items():
+        if count < 3:
+            continue
+        tarikh = date(tahun, bulan, 28)
+        if random.random() < surat_ratio:
+            surat.append({'murid_id': murid_id, 'bulan': bulan, 'tahun': tahun,
+                          'printed_by': random.choice(user_ids)})
+        if random.random() < denda_ratio:
+            completed = tarikh < date.today() - timedelta(days=14) and random.random() < 0.8
+            denda.append({
+                'murid_id': murid_id,
+                'jenis_denda': random.choice(JENIS_DENDA),
+                'tarikh': min(tarikh, date.today()),
+                'status': 'completed' if completed else 'pending',
+                'nota': '',
+                'assigned_by': random.choice(user_ids)
+            })
+    bulk_insert(Denda, denda)
+    bulk_insert(SuratAmaran, surat)
+    return len(denda), len(surat)
+
+
+def generate(students=2000, years=2, per_day=40, kelas_per_tingkatan=6,
+             denda_ratio=0.5, surat_ratio=0.7, seed=1):
+    """Add synthetic data to the current database; returns what was created."""
+    random.seed(seed)
+    user_ids = [u.id for u in User.query.all()]
+
+    kelas_ids = create_kelas(kelas_per_tingkatan)
+    murid_ids = create_murid(students, kelas_ids)
+    kehadiran, monthly = create_kehadiran(murid_ids, years, per_day, user_ids)
+    denda, surat = create_denda_and_surat(monthly, user_ids, denda_ratio, surat_ratio)
+    db.session.commit()
+
+    appmod.rebuild_rumusan_harian()
+    appmod.rebuild_kiraan_bulanan()
+    appmod.weekly_stats_cache.invalidate()
+    appmod.reference_cache.invalidate()
+
+    return {'kelas': len(kelas_ids), 'murid': len(murid_ids), 'kehadiran_lewat': kehadiran,
+            'denda': denda, 'surat_amaran': surat}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=2000)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--per-day', type=int, default=40, help='average late arrivals per school day')
+    parser.add_argument('--kelas', type=int, default=6, help='kelas per tingkatan (max 8)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with appmod.app.app_context():
+        appmod.init_database()
+        created = generate(args.students, args.years, args.per_day, args.kelas, seed=args.seed)
+    print(', '.join(f'{count} {name}' for name, count in created.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+from collections import Counter
+
+# Late-arrival PDF reports. Like surat.py this is kept free of Flask and
+# database imports so report jobs can render from plain rows, and
+# reportlab is imported on first render.
+#
+# Rows are drawn as they arrive, so a year of records is never held in
+# memory at once. Every page gets the same header, column headings and
+# page number; a section that runs onto a new page repeats its heading.
+# reportlab keeps finished pages until save(), so rows go into one text
+# object per run of rows: a page is then held as a few strings rather
+# than one per drawString.
+
+# (heading, x, width) in points on an A4 page
+COLUMNS = [
+    ('Tarikh', 50, 65),
+    ('Masa', 115, 40),
+    ('Nama', 155, 225),
+    ('Kelas', 380, 100),
+    ('Jantina', 480, 65),
+]
+FONT = 'Helvetica'
+FONT_BOLD = 'Helvetica-Bold'
+FONT_SIZE = 9
+LINE_HEIGHT = 12
+ROW_GAP = 3
+MARGIN_TOP = 50
+MARGIN_BOTTOM = 50
+
+class LaporanCanvas:
+    """A canvas that lays out report rows on repeating page templates."""
+
+    def __init__(self, output, title, subtitle, totals):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        self.canvas = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+        self.width, self.height = A4
+        self.title = title
+        self.subtitle = subtitle
+        self.totals = totals
+        self.pages = 0
+        self.y = None
+        self.section = None
+        self.text = None
+
+    def flush_text(self):
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.text = None
+
+    def new_page(self):
+        self.flush_text()
+        if self.pages:
+            self.canvas.showPage()
+        self.pages += 1
+        c = self.canvas
+        top = self.height - MARGIN_TOP
+
+        c.setFont(FONT, 8)
+        c.drawRightString(self.width - 50, MARGIN_BOTTOM - 25, f"Muka surat {self.pages}")
+
+        if self.pages == 1:
+            c.setFont(FONT_BOLD, 16)
+            c.drawCentredString(self.width / 2, top, self.title)
+            c.setFont(FONT, 12)
+            c.drawCentredString(self.width / 2, top - 20, self.subtitle)
+            c.setFont(FONT_BOLD, 12)
+            c.drawString(50, top - 60, f"Jumlah Keseluruhan: {self.totals['jumlah']}")
+            c.drawString(250, top - 60, f"Lelaki: {self.totals['Lelaki']}")
+            c.drawString(350, top - 60, f"Perempuan: {self.totals['Perempuan']}")
+            self.y = top - 100
+        else:
+            c.setFont(FONT_BOLD, 11)
+            c.drawCentredString(self.width / 2, top, self.title)
+            c.setFont(FONT, 9)
+            c.drawCentredString(self.width / 2, top - 14, self.subtitle)
+            self.y = top - 40
+        if self.section:
+            self.draw_section(f"{self.section} (sambungan)")
+        self.draw_column_headings()
+
+    def draw_column_headings(self):
+        c = self.canvas
+        c.setFont(FONT_BOLD, 10)
+        for heading, x, _ in COLUMNS:
+            c.drawString(x, self.y, heading)
+        c.line(50, self.y - 4, self.width - 50, self.y - 4)
+        self.y -= LINE_HEIGHT + 6
+
+    def draw_section(self, text):
+        self.flush_text()
+        c = self.canvas
+        c.setFillGray(0.9)
+        c.rect(45, self.y - 4, self.width - 90, LINE_HEIGHT + 4, stroke=0, fill=1)
+        c.setFillGray(0)
+        c.setFont(FONT_BOLD, 10)
+        c.drawString(50, self.y, text)
+        self.y -= LINE_HEIGHT + 8
+
+    def make_room(self, height):
+        if self.y is None or self.y - height < MARGIN_BOTTOM:
+            self.new_page()
+
+    def start_section(self, text):
+        self.section = None
+        # Keep a heading with at least its first row
+        self.make_room(3 * LINE_HEIGHT + 24)
+        self.section = text
+        self.draw_section(text)
+
+    def row(self, tarikh, masa_sampai, nama_penuh, nama_kelas, jantina):
+        from reportlab.lib.utils import simpleSplit
+
+        # Long names wrap inside their column instead of being cut off
+        nama_lines = simpleSplit(nama_penuh, FONT, FONT_SIZE, COLUMNS[2][2])
+        self.make_room(len(nama_lines) * LINE_HEIGHT)
+
+        if self.text is None:
+            self.text = self.canvas.beginText()
+            self.text.setFont(FONT, FONT_SIZE)
+        text = self.text
+        for x, value in ((COLUMNS[0][1], tarikh.strftime('%d/%m/%Y')),
+                         (COLUMNS[1][1], masa_sampai.strftime('%H:%M')),
+                         (COLUMNS[3][1], nama_kelas),
+                         (COLUMNS[4][1], jantina)):
+            text.setTextOrigin(x, self.y)
+            text.textOut(value)
+        for index, line in enumerate(nama_lines):
+            text.setTextOrigin(COLUMNS[2][1], self.y - index * LINE_HEIGHT)
+            text.textOut(line)
+        self.y -= len(nama_lines) * LINE_HEIGHT + ROW_GAP
+
+    def subtotal(self, label, counts):
+        self.make_room(LINE_HEIGHT + 8)
+        self.flush_text()
+        c = self.canvas
+        c.line(COLUMNS[2][1], self.y + LINE_HEIGHT - 2, self.width - 50, self.y + LINE_HEIGHT - 2)
+        c.setFont(FONT_BOLD, FONT_SIZE)
+        c.drawString(COLUMNS[2][1], self.y,
+                     f"{label}: {counts['jumlah']} (Lelaki {counts['Lelaki']}, Perempuan {counts['Perempuan']})")
+        self.y -= LINE_HEIGHT + 8
+
+    def save(self):
+        if self.y is None:
+            self.new_page()
+        self.flush_text()
+        self.canvas.save()
+
+def count_row(counts, jantina):
+    counts['jumlah'] += 1
+    counts[jantina] += 1
+
+def render_laporan_pdf(output, rows, title, subtitle, totals, group='tarikh'):
+    """Draw rows into a PDF written to output (a path or binary file); returns the page count.
+
+    rows is an iterable of (tarikh, masa_sampai, nama_penuh, nama_kelas,
+    jantina, nama_tingkatan) tuples, already in print order. With
+    group='kelas' they must be sorted by Tingkatan then kelas: each kelas
+    gets a section with a subtotal, and each Tingkatan a subtotal after its
+    last kelas. totals holds the counts for the whole
+    report ('jumlah', 'Lelaki', 'Perempuan') for the first page.
+    """
+    totals = Counter(totals)
+    pdf = LaporanCanvas(output, title, subtitle, totals)
+
+    by_kelas = by_tingkatan = None
+    kelas = tingkatan = None
+    for tarikh, masa_sampai, nama_penuh, nama_kelas, jantina, nama_tingkatan in rows:
+        if group == 'kelas':
+            if nama_kelas != kelas or nama_tingkatan != tingkatan:
+                if by_kelas:
+                    pdf.subtotal(f"Jumlah {kelas}", by_kelas)
+                if nama_tingkatan != tingkatan and by_tingkatan:
+                    pdf.subtotal(f"Jumlah {tingkatan}", by_tingkatan)
+                    by_tingkatan = None
+                kelas, tingkatan = nama_kelas, nama_tingkatan
+                by_kelas = Counter()
+                by_tingkatan = by_tingkatan or Counter()
+                pdf.start_section(f"{nama_tingkatan} - {nama_kelas}")
+            count_row(by_kelas, jantina)
+            count_row(by_tingkatan, jantina)
+        pdf.row(tarikh, masa_sampai, nama_penuh, nama_kelas, jantina)
+
+    if by_kelas:
+        pdf.subtotal(f"Jumlah {kelas}", by_kelas)
+        pdf.subtotal(f"Jumlah {tingkatan}", by_tingkatan)
+    pdf.section = None
+    if group == 'kelas':
+        pdf.subtotal("Jumlah Keseluruhan", totals)
+
+    pdf.save()
+    return pdf.pages
+
+def laporan_filename(label):
+    return f"Laporan_Kehadiran_Lewat_{label}.pdf"
@@ -5,7 +5,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
-    passg
+    pass
 
 db = SQLAlchemy(model_class=Base)
 
@@ -61,6 +61,13 @@ class Murid(db.Model):
     
     kehadiran_lewat = db.relationship('KehadiranLewat', backref='murid', lazy=True)
 
+    __table_args__ = (
+        # Roster counts only ever look at active students
+        db.Index('ix_murid_kelas_aktif', 'kelas_id',
+                 postgresql_where=db.text('is_deleted = false'),
+                 sqlite_where=db.text('is_deleted = 0')),
+    )
+
 class CategoryAlasan(db.Model):
     __tablename__ = 'category_alasan'
     
@@ -85,6 +92,13 @@ class KehadiranLewat(db.Model):
     category = db.relationship('CategoryAlasan', backref='kehadiran_lewat')
     guru = db.relationship('User', backref='checked_records')
 
+    __table_args__ = (
+        db.Index('ix_kehadiran_lewat_tarikh', 'tarikh'),
+        db.Index('ix_kehadiran_lewat_tarikh_masa', 'tarikh', 'masa_sampai', 'id'),
+        db.Index('ix_kehadiran_lewat_murid_tarikh', 'murid_id', 'tarikh'),
+        db.Index('ix_kehadiran_lewat_category_tarikh', 'category_id', 'tarikh'),
+    )
+
 class Denda(db.Model):
     __tablename__ = 'denda'
     
@@ -101,6 +115,11 @@ class Denda(db.Model):
     murid = db.relationship('Murid', backref='denda')
     guru = db.relationship('User', backref='assigned_denda')
 
+    __table_args__ = (
+        # The denda board filters on status and pages by (tarikh, id)
+        db.Index('ix_denda_status_tarikh', 'status', 'tarikh', 'id'),
+    )
+
 class ActivityLog(db.Model):
     __tablename__ = 'activity_log'
     
@@ -124,3 +143,67 @@ class SuratAmaran(db.Model):
     
     murid = db.relationship('Murid', backref='surat_amaran')
     guru = db.relationship('User', backref='printed_surat')
+
+class RumusanHarian(db.Model):
+    __tablename__ = 'rumusan_harian'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tarikh = db.Column(db.Date, nullable=False)
+    kelas_id = db.Column(db.Integer, nullable=False)  # no FK: kelas can be deleted, history stays
+    category_id = db.Column(db.Integer, db.ForeignKey('category_alasan.id'))
+    jantina = db.Column(db.String(10), nullable=False)
+    jumlah = db.Column(db.Integer, nullable=False, default=0)
+
+    # One row per key. NULL category_id is coalesced so uncategorised
+    # check-ins also share a row; upserts name the same expression.
+    __table_args__ = (
+        db.Index('uq_rumusan_harian_kunci', 'tarikh', 'kelas_id',
+                 db.func.coalesce(category_id, db.literal_column('0')), 'jantina', unique=True),
+    )
+
+class KiraanLewatBulanan(db.Model):
+    __tablename__ = 'kiraan_lewat_bulanan'
+
+    id = db.Column(db.Integer, primary_key=True)
+    murid_id = db.Column(db.Integer, db.ForeignKey('murid.id'), nullable=False)
+    tahun = db.Column(db.Integer, nullable=False)
+    bulan = db.Column(db.Integer, nullable=False)
+    jumlah = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('murid_id', 'tahun', 'bulan', name='uq_kiraan_lewat_bulanan'),
+    )
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    versi = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CheckinIdempotency(db.Model):
+    __tablename__ = 'checkin_idempotency'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kunci = db.Column(db.String(100), unique=True, nullable=False)
+    kehadiran_id = db.Column(db.Integer, db.ForeignKey('kehadiran_lewat.id'), nullable=False)
+    murid_id = db.Column(db.Integer, db.ForeignKey('murid.id'), nullable=False)
+    kiraan_bulan = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ReportJob(db.Model):
+    __tablename__ = 'report_job'
+
+    id = db.Column(db.Integer, primary_key=True)
+    jenis = db.Column(db.String(30), nullable=False)  # 'laporan_pdf', 'surat'
+    bulan = db.Column(db.Integer, nullable=False)
+    tahun = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'running', 'done', 'failed'
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('jenis', 'tahun', 'bulan', name='uq_report_job_bulan'),
+    )
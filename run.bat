@@ -12,11 +12,15 @@ REM Install requirements
 echo Installing requirements...
 pip install -r requirements.txt
 
-REM Run Flask application
-echo Starting Flask application...
+REM Create tables and default data (safe to run every time)
+echo Preparing database...
+flask --app app init-db
+
+REM Run the production server (waitress); size it with WEB_THREADS
+echo Starting server...
 echo.
 echo Opening browser at http://localhost:5000
 echo Press Ctrl+C to stop the server
 echo.
-python app.py
+flask --app app serve
 pause
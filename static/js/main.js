@@ -186,6 +186,38 @@ function bulkDelete() {
     });
 }
 
+function promoteTingkatan(tingkatanId) {
+    const fail = (xhr) => Swal.fire('Ralat', xhr.responseJSON ? xhr.responseJSON.error : 'Ralat pelayan', 'error');
+    
+    $.post('/api/promote-tingkatan', { tingkatan_id: tingkatanId, dry_run: 1 }, function(preview) {
+        let html = `<p>${preview.naik} murid akan naik tingkatan.</p>`;
+        if (preview.tamat) {
+            html += `<p>${preview.tamat} murid akan tamat sekolah dan dikeluarkan dari senarai.</p>`;
+        }
+        if (preview.tiada_kelas_sepadan.length) {
+            html += `<p class="text-danger">Tiada kelas sepadan di tingkatan seterusnya untuk: ` +
+                    `${$('<span>').text(preview.tiada_kelas_sepadan.join(', ')).html()}</p>`;
+        }
+        
+        Swal.fire({
+            title: 'Naik Tingkatan?',
+            html: html,
+            icon: 'warning',
+            showCancelButton: true,
+            showConfirmButton: preview.tiada_kelas_sepadan.length === 0,
+            confirmButtonText: 'Ya, teruskan',
+            cancelButtonText: 'Batal'
+        }).then((result) => {
+            if (result.isConfirmed) {
+                $.post('/api/promote-tingkatan', { tingkatan_id: tingkatanId }, function(response) {
+                    Swal.fire('Berjaya', `${response.naik} murid naik tingkatan, ${response.tamat} murid tamat sekolah.`, 'success')
+                        .then(() => location.reload());
+                }).fail(fail);
+            }
+        });
+    }).fail(fail);
+}
+
 function getSelectedIds() {
     const ids = [];
     document.querySelectorAll('.row-checkbox:checked').forEach(cb => {
@@ -0,0 +1,125 @@
+import io
+
+# Kept free of Flask and database imports: batch rendering runs these
+# functions in worker processes that import only this module. python-docx
+# is imported on first render so importing the app stays fast.
+
+BULAN_NAMES = ['', 'Januari', 'Februari', 'Mac', 'April', 'Mei', 'Jun',
+               'Julai', 'Ogos', 'September', 'Oktober', 'November', 'Disember']
+HARI_NAMES = ['Isnin', 'Selasa', 'Rabu', 'Khamis', 'Jumaat', 'Sabtu', 'Ahad']
+
+_template_bytes = None
+
+def _load_template():
+    """Return the blank letter template, built once per process."""
+    global _template_bytes
+    from docx import Document
+    from docx.shared import Pt
+
+    if _template_bytes is None:
+        doc = Document()
+        style = doc.styles['Normal']
+        style.font.name = 'Times New Roman'
+        style.font.size = Pt(12)
+
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        _template_bytes = buffer.getvalue()
+    return Document(io.BytesIO(_template_bytes))
+
+def add_surat(doc, surat):
+    """Append one warning letter to doc.
+
+    surat is a plain dict: nama_penuh, nama_kelas, month, year, guru_name,
+    tarikh_surat and kehadiran, a list of (tarikh, masa_sampai) pairs.
+    """
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    header = doc.add_paragraph()
+    header.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    header.add_run(f"Tarikh: {surat['tarikh_surat'].strftime('%d/%m/%Y')}")
+
+    doc.add_paragraph()
+
+    title = doc.add_paragraph()
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title_run = title.add_run("Perkara: Surat Amaran – Kehadiran Lewat Melebihi 3 Kali")
+    title_run.bold = True
+
+    doc.add_paragraph()
+
+    doc.add_paragraph("Kepada:")
+    doc.add_paragraph(f"Nama Penuh Murid: {surat['nama_penuh']}")
+    doc.add_paragraph(f"Kelas: {surat['nama_kelas']}")
+
+    doc.add_paragraph()
+
+    doc.add_paragraph("Assalamualaikum dan Salam sejahtera")
+
+    doc.add_paragraph()
+
+    bulan_name = BULAN_NAMES[surat['month']]
+
+    content = doc.add_paragraph()
+    content.add_run(
+        f"Dengan segala hormatnya, saya selaku guru bertugas mingguan ingin memaklumkan bahawa "
+        f"murid yang dinyatakan di atas telah hadir lewat ke sekolah melebihi tiga (3) kali "
+        f"bagi bulan {bulan_name} {surat['year']}. Butiran kelewatan adalah seperti berikut:"
+    )
+
+    doc.add_paragraph()
+
+    for tarikh, masa_sampai in surat['kehadiran']:
+        hari = HARI_NAMES[tarikh.weekday()]
+        doc.add_paragraph(f"• {hari}, {tarikh.strftime('%d/%m/%Y')}, {masa_sampai.strftime('%H:%M')}")
+
+    doc.add_paragraph()
+
+    doc.add_paragraph(
+        "Kelewatan berulang ini adalah dikesan melalui guru bertugas mingguan dan dicatat "
+        "sebagai tindakan disiplin yang perlu diberi perhatian. Murid diminta untuk mengambil "
+        "perhatian serius terhadap perkara ini dan memastikan menghadirkan diri tepat pada "
+        "waktunya pada masa hadapan bagi mengelakkan tindakan disiplin seterusnya."
+    )
+
+    doc.add_paragraph()
+
+    doc.add_paragraph("Sekian, terima kasih atas kerjasama pihak murid dan ibubapa/penjaga.")
+
+    doc.add_paragraph()
+    doc.add_paragraph()
+
+    signature = doc.add_paragraph()
+    signature.add_run("Yang benar,")
+    doc.add_paragraph()
+    doc.add_paragraph()
+
+    guru_para = doc.add_paragraph()
+    guru_run = guru_para.add_run(f"({surat['guru_name']})")
+    guru_run.bold = True
+    doc.add_paragraph("Guru Bertugas Mingguan")
+
+def _save(doc):
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def render_surat(surat):
+    """Render one letter and return the .docx bytes."""
+    doc = _load_template()
+    add_surat(doc, surat)
+    return _save(doc)
+
+def render_surat_merged(surat_list):
+    """Render every letter into one .docx, one letter per page."""
+    from docx.enum.text import WD_BREAK
+
+    doc = _load_template()
+    for index, surat in enumerate(surat_list):
+        if index:
+            doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+        add_surat(doc, surat)
+    return _save(doc)
+
+def surat_filename(surat):
+    return f"Surat_Amaran_{surat['nama_penuh'].replace(' ', '_')}_{surat['month']}_{surat['year']}.docx"
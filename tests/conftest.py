@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads DATABASE_URL on import. Tests never touch the configured
+# database: they use TEST_DATABASE_URL (for example a scratch PostgreSQL
+# database) or a fresh SQLite file.
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or \
+    'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['ARTIFACT_DIR'] = tempfile.mkdtemp()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as appmod
+from models import db
+
+
+@pytest.fixture
+def app():
+    appmod.app.config['TESTING'] = True
+    with appmod.app.app_context():
+        db.drop_all()
+        appmod.init_database()
+    yield appmod.app
+    appmod.reference_cache.invalidate()
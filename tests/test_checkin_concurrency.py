@@ -0,0 +1,73 @@
+"""Several gate teachers checking the same student in at once.
+
+Every check-in runs in its own client and session, so record_checkin and
+bump_kiraan_bulanan race on the same (murid_id, tahun, bulan) row. SQLite
+lets one writer in at a time; set TEST_DATABASE_URL to a scratch
+PostgreSQL database to run the gates truly in parallel.
+"""
+import re
+import threading
+
+from sqlalchemy import func, extract
+
+from models import db, Kelas, Murid, KehadiranLewat, KiraanLewatBulanan
+
+GATES = 8
+CHECKINS_PER_GATE = 5
+IC = '080808-10-8888'
+
+
+def checkin_from_gate(app, kelas_id, counts, errors):
+    client = app.test_client()
+    client.post('/login', data={'username': 'guru', 'password': 'smkserikundang7620'})
+    for _ in range(CHECKINS_PER_GATE):
+        # New-student form: the first gates also race to create the Murid
+        response = client.post('/dashboard/checkin', data={
+            'nama_penuh': 'Murid Serentak', 'ic': IC, 'jantina': 'Lelaki',
+            'kelas_id': str(kelas_id), 'alasan': 'jalan sesak', 'minit_lewat': '5'
+        }, follow_redirects=True)
+        page = response.get_data(as_text=True)
+        match = re.search(r'Lewat kali ke-(\d+)', page)
+        if match:
+            counts.append(int(match.group(1)))
+        elif 'telah lewat 3 kali' in page:
+            counts.append(3)
+        else:
+            errors.append(response.status_code)
+
+
+def test_parallel_checkins_keep_monthly_counter_exact(app):
+    with app.app_context():
+        kelas = Kelas(nama_kelas='1 Amanah', tingkatan_id=1)
+        db.session.add(kelas)
+        db.session.commit()
+        kelas_id = kelas.id
+
+    counts, errors = [], []
+    gates = [threading.Thread(target=checkin_from_gate, args=(app, kelas_id, counts, errors))
+             for _ in range(GATES)]
+    for gate in gates:
+        gate.start()
+    for gate in gates:
+        gate.join()
+
+    assert errors == []
+    # Each check-in got its own place in the month's count
+    assert sorted(counts) == list(range(1, GATES * CHECKINS_PER_GATE + 1))
+
+    with app.app_context():
+        murid_ids = [m.id for m in Murid.query.filter_by(ic='080808108888')]
+        assert len(murid_ids) == 1
+
+        recorded = dict(((int(tahun), int(bulan)), jumlah) for tahun, bulan, jumlah in db.session.query(
+            extract('year', KehadiranLewat.tarikh),
+            extract('month', KehadiranLewat.tarikh),
+            func.count(KehadiranLewat.id)
+        ).filter(KehadiranLewat.murid_id == murid_ids[0]).group_by(
+            extract('year', KehadiranLewat.tarikh), extract('month', KehadiranLewat.tarikh)
+        ))
+        counters = KiraanLewatBulanan.query.filter_by(murid_id=murid_ids[0]).all()
+
+        assert sum(recorded.values()) == GATES * CHECKINS_PER_GATE
+        assert len(counters) == len(recorded)
+        assert {(c.tahun, c.bulan): c.jumlah for c in counters} == recorded
@@ -0,0 +1,84 @@
+"""rumusan_harian must always agree with the raw kehadiran_lewat table.
+
+Counts sit under each student's current kelas and jantina, so every route
+that changes either has to move the student's history with them.
+"""
+import io
+
+from sqlalchemy import func
+
+from models import db, Tingkatan, Kelas, Murid, KehadiranLewat, RumusanHarian
+
+STUDENTS = (('Ali', '010101010101'), ('Abu', '020202020202'), ('Siti', '030303030303'))
+
+
+def assert_rollup_matches(app):
+    with app.app_context():
+        key = (KehadiranLewat.tarikh, Murid.kelas_id, KehadiranLewat.category_id, Murid.jantina)
+        raw = {tuple(row[:4]): row[4] for row in db.session.query(
+            *key, func.count(KehadiranLewat.id)
+        ).join(Murid, Murid.id == KehadiranLewat.murid_id).group_by(*key)}
+
+        rows = db.session.query(
+            RumusanHarian.tarikh, RumusanHarian.kelas_id, RumusanHarian.category_id,
+            RumusanHarian.jantina, RumusanHarian.jumlah
+        ).all()
+        # One row per key, uncategorised check-ins included
+        assert len(rows) == len({tuple(row[:4]) for row in rows})
+        assert {tuple(row[:4]): row[4] for row in rows if row[4]} == raw
+
+
+def kelas_of(app, murid_id):
+    with app.app_context():
+        murid = db.session.get(Murid, murid_id)
+        return murid.kelas_id, murid.jantina
+
+
+def test_rollup_follows_checkins_edits_and_moves(app):
+    with app.app_context():
+        t1, t2 = [t.id for t in Tingkatan.query.order_by(Tingkatan.id)[:2]]
+        for nama, tingkatan_id in (('1 Amanah', t1), ('1 Bestari', t1), ('2 Amanah', t2), ('2 Bestari', t2)):
+            db.session.add(Kelas(nama_kelas=nama, tingkatan_id=tingkatan_id))
+        db.session.commit()
+        k1, k2, k3, k4 = [k.id for k in Kelas.query.order_by(Kelas.id)]
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'skuses7620'})
+    for nama, ic in STUDENTS:
+        # A blank alasan leaves category_id NULL
+        for alasan in ('hujan lebat', 'tertinggal barang', ''):
+            client.post('/dashboard/checkin', data={
+                'nama_penuh': nama, 'ic': ic, 'jantina': 'Lelaki', 'kelas_id': str(k1),
+                'alasan': alasan, 'minit_lewat': '5'
+            })
+    with app.app_context():
+        ali, abu, siti = [m.id for m in Murid.query.order_by(Murid.id)]
+        assert KehadiranLewat.query.count() == 9
+        assert KehadiranLewat.query.filter(KehadiranLewat.category_id.is_(None)).count() == 3
+    assert_rollup_matches(app)
+
+    client.post(f'/dashboard/murid/{siti}/edit', data={
+        'nama_penuh': 'Siti', 'ic': STUDENTS[2][1], 'jantina': 'Perempuan'
+    })
+    assert kelas_of(app, siti) == (k1, 'Perempuan')
+    assert_rollup_matches(app)
+
+    client.post(f'/dashboard/murid/{ali}/pindah', data={'action': 'pindah_kelas', 'new_kelas_id': str(k2)})
+    assert kelas_of(app, ali) == (k2, 'Lelaki')
+    assert_rollup_matches(app)
+
+    assert client.post('/api/bulk-move', data={'ids': str(abu), 'kelas_id': str(k2)}).json['success']
+    assert kelas_of(app, abu) == (k2, 'Lelaki')
+    assert_rollup_matches(app)
+
+    assert client.post('/api/promote-tingkatan', data={'tingkatan_id': str(t1)}).json['success']
+    assert kelas_of(app, siti) == (k3, 'Perempuan')
+    assert kelas_of(app, ali) == kelas_of(app, abu) == (k4, 'Lelaki')
+    assert_rollup_matches(app)
+
+    # A roster import updates an existing IC's kelas and jantina in place
+    roster = f'nama_penuh,ic,jantina,kelas\nAli,{STUDENTS[0][1]},Perempuan,2 Amanah\n'
+    client.post('/dashboard/murid/import', data={'fail': (io.BytesIO(roster.encode()), 'murid.csv')},
+                content_type='multipart/form-data')
+    assert kelas_of(app, ali) == (k3, 'Perempuan')
+    assert_rollup_matches(app)